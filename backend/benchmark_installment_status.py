@@ -0,0 +1,68 @@
+import os
+import sys
+import time
+from datetime import date, datetime
+
+import numpy as np
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "benchmark")
+
+from server import (
+    INSTALLMENT_STATUS_BY_CODE,
+    calculate_installment_status,
+    rollup_case_statuses,
+    to_datetime64_days,
+    vectorized_installment_status,
+)
+
+
+def build_sample(size: int, case_count: int, today: date):
+    rng = np.random.default_rng(42)
+    today_day = np.datetime64(today, "D")
+    due_dates = today_day + rng.integers(-400, 400, size).astype("timedelta64[D]")
+    paid_dates = np.where(rng.random(size) < 0.4, due_dates, np.datetime64("NaT"))
+    case_index = rng.integers(0, case_count, size)
+    return case_index, due_dates, paid_dates
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    case_count = max(size // 12, 1)
+    today = date.today()
+    case_index, due_dates, paid_dates = build_sample(size, case_count, today)
+
+    # Valores como chegam do Mongo: datetime ingênuo à meia-noite ou None.
+    stored_due = [datetime.combine(value, datetime.min.time()) for value in due_dates.astype(date)]
+    stored_paid = [
+        None if np.isnat(value) else datetime.combine(value.astype(date), datetime.min.time())
+        for value in paid_dates
+    ]
+
+    started = time.perf_counter()
+    scalar = [calculate_installment_status(due, paid) for due, paid in zip(stored_due, stored_paid)]
+    scalar_seconds = time.perf_counter() - started
+
+    # Os tempos vetorizados incluem a conversão dos valores armazenados, como em compute_case_batch_fields.
+    started = time.perf_counter()
+    codes = vectorized_installment_status(to_datetime64_days(stored_due), to_datetime64_days(stored_paid), today)
+    vector_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    rollup_case_statuses(
+        case_index, to_datetime64_days(stored_due), to_datetime64_days(stored_paid), case_count, today
+    )
+    rollup_seconds = time.perf_counter() - started
+
+    mismatches = sum(
+        1 for status, code in zip(scalar, codes.tolist()) if status != INSTALLMENT_STATUS_BY_CODE[code]
+    )
+    print(f"Parcelas: {size:,} em {case_count:,} casos (hoje = {today})")
+    print(f"  Escalar (calculate_installment_status): {scalar_seconds:8.3f}s")
+    print(f"  Vetorizado (conversão + status):        {vector_seconds:8.3f}s  ({scalar_seconds / vector_seconds:,.1f}x)")
+    print(f"  Vetorizado (conversão + rollup):        {rollup_seconds:8.3f}s")
+    print(f"  Divergências: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import argparse
+import asyncio
+import time
+from typing import Any
+
+from pymongo import DeleteMany, UpdateOne
+
+from server import (
+    CASE_COUNT_CACHE_TTL_SECONDS,
+    MATERIALIZATION_BATCH_SIZE,
+    client,
+    compute_case_batch_fields,
+    db,
+    sync_receipts_ledger,
+)
+
+CHECKED_FIELDS = [
+    "has_agreement",
+    "status_acordo",
+    "status_processo",
+    "total_received",
+    "percent_recovered",
+    "next_status_change_at",
+]
+FLOAT_TOLERANCE = 0.01
+
+
+def find_drift(case: dict[str, Any], expected: dict[str, Any]) -> dict[str, tuple[Any, Any]]:
+    drift: dict[str, tuple[Any, Any]] = {}
+    for field in CHECKED_FIELDS:
+        if field not in expected:
+            continue
+        # Sem acordo o status_acordo pode ter sido definido manualmente (bulk update).
+        if field == "status_acordo" and not expected["has_agreement"]:
+            continue
+        stored = case.get(field)
+        wanted = expected[field]
+        if isinstance(wanted, float):
+            if stored is None or abs(float(stored) - wanted) > FLOAT_TOLERANCE:
+                drift[field] = (stored, wanted)
+        elif stored != wanted:
+            drift[field] = (stored, wanted)
+    return drift
+
+
+async def check_batch(
+    cases: list[dict[str, Any]],
+    semaphore: asyncio.Semaphore,
+    repair: bool,
+    report: dict[str, Any],
+) -> None:
+    async with semaphore:
+        expected_by_case = await compute_case_batch_fields(cases)
+        operations = []
+        for case in cases:
+            drift = find_drift(case, expected_by_case[case["id"]])
+            if not drift:
+                continue
+            report["drifted"] += 1
+            if len(report["samples"]) < 20:
+                report["samples"].append((case["id"], drift))
+            if repair:
+                operations.append(
+                    UpdateOne(
+                        {"id": case["id"]},
+                        {"$set": {field: wanted for field, (_, wanted) in drift.items()}, "$inc": {"version": 1}},
+                    )
+                )
+        if operations:
+            await db.cases.bulk_write(operations, ordered=False)
+            report["repaired"] += len(operations)
+        report["checked"] += len(cases)
+
+
+async def check_cases(query: dict[str, Any], batch_size: int, concurrency: int, repair: bool) -> dict[str, Any]:
+    report: dict[str, Any] = {"checked": 0, "drifted": 0, "repaired": 0, "samples": []}
+    semaphore = asyncio.Semaphore(concurrency)
+    pending: set[asyncio.Task] = set()
+    projection = {"_id": 0, "id": 1, "user_id": 1, "value_causa": 1, **{field: 1 for field in CHECKED_FIELDS}}
+
+    batch: list[dict[str, Any]] = []
+    async for case in db.cases.find(query, projection).batch_size(batch_size):
+        batch.append(case)
+        if len(batch) < batch_size:
+            continue
+        # Limita quantos lotes ficam em memória aguardando o semáforo.
+        if len(pending) >= concurrency * 2:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        pending.add(asyncio.create_task(check_batch(batch, semaphore, repair, report)))
+        batch = []
+    if batch:
+        pending.add(asyncio.create_task(check_batch(batch, semaphore, repair, report)))
+    if pending:
+        await asyncio.gather(*pending)
+    return report
+
+
+async def find_orphan_ids(collection, local_field: str, target: str) -> list[dict[str, Any]]:
+    pipeline = [
+        {"$project": {"_id": 0, "id": 1, "case_id": 1, local_field: 1}},
+        {
+            "$lookup": {
+                "from": target,
+                "localField": local_field,
+                "foreignField": "id",
+                "pipeline": [{"$project": {"_id": 0, "id": 1}}, {"$limit": 1}],
+                "as": "parent",
+            }
+        },
+        {"$match": {"parent": {"$size": 0}}},
+        {"$project": {"parent": 0}},
+    ]
+    return await collection.aggregate(pipeline, allowDiskUse=True).to_list(None)
+
+
+async def check_orphans(repair: bool) -> dict[str, int]:
+    # Acordos não guardam user_id e um órfão não tem caso do qual herdar o dono: a busca é sempre global.
+    orphan_agreements = await find_orphan_ids(db.agreements, "case_id", "cases")
+    orphan_installments = await find_orphan_ids(db.installments, "agreement_id", "agreements")
+    orphan_alvaras = await find_orphan_ids(db.alvaras, "case_id", "cases")
+
+    orphan_agreement_ids = [agreement["id"] for agreement in orphan_agreements]
+    if orphan_agreement_ids:
+        # Parcelas de acordos órfãos também ficam órfãs após o reparo.
+        orphan_installments += await db.installments.find(
+            {"agreement_id": {"$in": orphan_agreement_ids}},
+            {"_id": 0, "id": 1, "case_id": 1, "agreement_id": 1},
+        ).to_list(None)
+
+    if repair:
+        affected_cases: set[str] = set()
+        for collection, docs in (
+            (db.agreements, orphan_agreements),
+            (db.installments, orphan_installments),
+            (db.alvaras, orphan_alvaras),
+        ):
+            ids = list({doc["id"] for doc in docs})
+            affected_cases.update(doc["case_id"] for doc in docs if doc.get("case_id"))
+            if ids:
+                operations = [
+                    DeleteMany({"id": {"$in": ids[offset:offset + MATERIALIZATION_BATCH_SIZE]}})
+                    for offset in range(0, len(ids), MATERIALIZATION_BATCH_SIZE)
+                ]
+                await collection.bulk_write(operations, ordered=False)
+        if affected_cases:
+            await sync_receipts_ledger(list(affected_cases))
+
+    return {
+        "agreements": len(orphan_agreements),
+        "installments": len({inst["id"] for inst in orphan_installments}),
+        "alvaras": len(orphan_alvaras),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Verifica campos materializados dos casos e registros órfãos")
+    parser.add_argument("--repair", action="store_true", help="corrige divergências e remove órfãos")
+    parser.add_argument("--user-id", help="limita a verificação de casos a um usuário")
+    parser.add_argument("--batch-size", type=int, default=MATERIALIZATION_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    query = {"user_id": args.user_id} if args.user_id else {}
+
+    started = time.perf_counter()
+    report = await check_cases(query, args.batch_size, args.concurrency, args.repair)
+    elapsed = time.perf_counter() - started
+    rate = report["checked"] / elapsed if elapsed else 0.0
+
+    print(f"Casos verificados: {report['checked']} em {elapsed:.2f}s ({rate:.0f} casos/s)")
+    print(f"Casos com divergência: {report['drifted']}{' (corrigidos)' if args.repair else ''}")
+    for case_id, drift in report["samples"]:
+        details = ", ".join(f"{field}: {stored!r} -> {wanted!r}" for field, (stored, wanted) in drift.items())
+        print(f"  {case_id}: {details}")
+    if report["repaired"]:
+        # O cache de contagens vive no processo da API; este script não tem como limpá-lo.
+        print(f"Totais em cache na API podem ficar desatualizados por até {CASE_COUNT_CACHE_TTL_SECONDS}s")
+
+    orphans = await check_orphans(args.repair)
+    print(
+        f"Órfãos: {orphans['agreements']} acordos, {orphans['installments']} parcelas, "
+        f"{orphans['alvaras']} alvarás{' (removidos)' if args.repair else ''}"
+    )
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
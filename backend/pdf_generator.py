@@ -76,7 +76,7 @@ def generate_receipts_pdf(data, filters):
         for receipt in receipts[:50]:  # Limitar a 50 linhas
             table_data.append([
                 format_date(receipt.get('date', '')),
-                receipt.get('debtor', '')[:20],
+                (receipt.get('debtor') or '')[:20],
                 receipt.get('type', ''),
                 format_currency(receipt.get('value', 0)),
                 receipt.get('beneficiario', '-')
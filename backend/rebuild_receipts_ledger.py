@@ -0,0 +1,13 @@
+import asyncio
+
+from server import client, rebuild_receipts_ledger
+
+
+async def main():
+    processed = await rebuild_receipts_ledger()
+    print(f"Ledger de recebimentos reconstruído: {processed} casos processados")
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
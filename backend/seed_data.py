@@ -7,6 +7,8 @@ from pathlib import Path
 import uuid
 from passlib.context import CryptContext
 
+from server import client as server_client, rebuild_receipts_ledger
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
@@ -34,6 +36,8 @@ async def clear_collections():
     await db.cases.delete_many({})
     await db.agreements.delete_many({})
     await db.installments.delete_many({})
+    await db.receipts_ledger.delete_many({})
+    await db.receipts_monthly.delete_many({})
     print("Coleções limpas!")
 
 
@@ -132,7 +136,7 @@ async def create_seed_data():
                 paid_value = None
                 
                 if i < 2:
-                    paid_date = (due_date - timedelta(days=2)).strftime("%Y-%m-%d")
+                    paid_date = due_date - timedelta(days=2)
                     paid_value = installment_value
                 elif i == 2:
                     pass
@@ -140,8 +144,10 @@ async def create_seed_data():
                 installment = {
                     "id": installment_id,
                     "agreement_id": agreement_id,
+                    "case_id": case_id,
+                    "user_id": user_id,
                     "number": i + 1,
-                    "due_date": due_date.strftime("%Y-%m-%d"),
+                    "due_date": due_date,
                     "paid_date": paid_date,
                     "paid_value": paid_value,
                     "status_calc": "Pago" if paid_date else "pending",
@@ -158,6 +164,10 @@ async def create_seed_data():
 async def main():
     await clear_collections()
     await create_seed_data()
+    # As parcelas pagas do seed são gravadas direto no banco; o ledger de recebimentos é reconstruído ao final.
+    processed = await rebuild_receipts_ledger()
+    print(f"Ledger de recebimentos reconstruído: {processed} casos processados")
+    server_client.close()
     client.close()
 
 
@@ -1,22 +1,33 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Header, Response
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import DeleteMany, InsertOne, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError
+from pdf_generator import generate_receipts_pdf
 import os
+import re
+import asyncio
 import logging
+import unicodedata
 from pathlib import Path
 from pydantic import BaseModel, EmailStr
 from typing import Optional, Any
 import uuid
 from datetime import datetime, date, timedelta, timezone
-from dateutil.relativedelta import relativedelta
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 import pandas as pd
 import tempfile
 import numpy as np
 import json
+import base64
+import time
+import bisect
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / ".env")
@@ -34,7 +45,8 @@ app.add_middleware(
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
-    allow_headers=["*"]
+    allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -42,15 +54,51 @@ SECRET_KEY = os.environ.get("SECRET_KEY", "your-secret-key-change-in-production"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7
 
+# bcrypt é CPU-bound e bloqueia o event loop; roda em threads dedicadas.
+PASSWORD_HASH_WORKERS = os.cpu_count() or 1
+PASSWORD_EXECUTOR = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+LOGIN_VERIFY_SEMAPHORE = asyncio.Semaphore(PASSWORD_HASH_WORKERS)
+
 logger = logging.getLogger("uvicorn")
 
 IMPORT_SESSIONS: dict[str, dict[str, Any]] = {}
 MAX_IMPORT_FILE_SIZE_MB = 10
 IMPORT_ALLOWED_EXTENSIONS = {".csv", ".xls", ".xlsx"}
 
+STATEMENT_ALLOWED_EXTENSIONS = {".csv", ".ofx"}
+STATEMENT_MAX_WINDOW_DAYS = 60
+STATEMENT_MAX_CANDIDATES = 3
+STATEMENT_COLUMN_ALIASES = {
+    "date": ["data", "date", "data lancamento", "data movimento", "dt"],
+    "value": ["valor", "value", "amount", "credito", "valor r"],
+    "description": ["descricao", "historico", "description", "memo", "lancamento"],
+}
+
 IMPORT_REQUIRED_FIELDS: dict[str, list[str]] = {}
 IMPORT_ENFORCE_REQUIRED_FIELDS = False
 
+CASE_COUNT_CACHE: dict[str, dict[str, tuple[int, bool, float]]] = {}
+CASE_COUNT_CACHE_TTL_SECONDS = 60
+CASE_COUNT_CACHE_MAX_KEYS_PER_USER = 256
+CASE_COUNT_ESTIMATE_PAGES = 10
+
+USER_CACHE: OrderedDict[str, tuple[dict[str, Any], float]] = OrderedDict()
+USER_CACHE_TTL_SECONDS = 60
+USER_CACHE_MAX_ENTRIES = 1024
+USER_CACHE_STATS = {"hits": 0, "misses": 0, "evictions": 0}
+
+INSTALLMENT_INSERT_BATCH_SIZE = 1000
+MAX_BULK_PAY_ITEMS = 1000
+MAX_INSTALLMENTS_COUNT = 600
+MAX_CASE_BATCH_SIZE = 300
+MONGO_TRANSACTIONS_SUPPORTED: Optional[bool] = None
+
+BACKGROUND_TASKS: set[asyncio.Task] = set()
+
+PENDING_CASE_RECOMPUTES: set[str] = set()
+CASE_RECOMPUTE_WAKEUP = asyncio.Event()
+CASE_RECOMPUTE_DEBOUNCE_SECONDS = 0.5
+
 class User(BaseModel):
     id: str
     email: EmailStr
@@ -139,6 +187,16 @@ class Agreement(BaseModel):
     entry_date: Optional[str] = None
     created_at: Optional[str] = None
 
+class AgreementPreview(BaseModel):
+    installments_count: int
+    installment_value: float = 0.0
+    first_due_date: str
+    has_entry: Optional[bool] = False
+    entry_value: Optional[float] = 0.0
+    entry_via_alvara: Optional[bool] = False
+    entry_date: Optional[str] = None
+
+
 class AgreementUpdate(BaseModel):
     total_value: Optional[float] = None
     installments_count: Optional[int] = None
@@ -155,6 +213,16 @@ class InstallmentUpdate(BaseModel):
     paid_value: Optional[float] = None
 
 
+class InstallmentPayment(BaseModel):
+    installment_id: str
+    paid_date: str
+    paid_value: float
+
+
+class InstallmentBulkPay(BaseModel):
+    items: list[InstallmentPayment]
+
+
 class AlvaraCreate(BaseModel):
     case_id: str
     data_alvara: str
@@ -187,6 +255,17 @@ class ImportCommitRequest(BaseModel):
     mapping: dict
 
 
+class StatementMatchRequest(BaseModel):
+    session_id: str
+    mapping: Optional[dict] = None
+    window_days: int = 5
+
+
+class StatementConfirmRequest(BaseModel):
+    session_id: str
+    items: list[InstallmentPayment]
+
+
 class CaseBulkUpdateFields(BaseModel):
     status_processo: Optional[str] = None
     polo_ativo_text: Optional[str] = None
@@ -202,6 +281,10 @@ class CaseBulkDeleteRequest(BaseModel):
     case_ids: list[str]
 
 
+class CaseBatchRequest(BaseModel):
+    case_ids: list[str]
+
+
 security = HTTPBearer()
 
 
@@ -209,6 +292,13 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    # O semáforo do asyncio é FIFO: logins em fila são atendidos na ordem de chegada.
+    async with LOGIN_VERIFY_SEMAPHORE:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(PASSWORD_EXECUTOR, verify_password, plain_password, hashed_password)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
@@ -231,6 +321,54 @@ def safe_parse_date(value: Any) -> Optional[date]:
     return None
 
 
+def to_db_date(value: Any) -> Optional[datetime]:
+    parsed = safe_parse_date(value)
+    if not parsed:
+        return None
+    return datetime(parsed.year, parsed.month, parsed.day)
+
+
+STORED_DATE_FIELDS = ("due_date", "paid_date", "data_alvara")
+
+
+def serialize_stored_dates(document: Optional[dict[str, Any]]) -> Optional[dict[str, Any]]:
+    if not document:
+        return document
+    for field in STORED_DATE_FIELDS:
+        value = document.get(field)
+        if isinstance(value, (datetime, date)):
+            document[field] = value.isoformat()[:10]
+    return document
+
+
+def get_cached_user(user_id: str) -> Optional[dict[str, Any]]:
+    entry = USER_CACHE.get(user_id)
+    if entry is None or entry[1] < time.monotonic():
+        if entry is not None:
+            USER_CACHE.pop(user_id, None)
+        USER_CACHE_STATS["misses"] += 1
+        return None
+    USER_CACHE.move_to_end(user_id)
+    USER_CACHE_STATS["hits"] += 1
+    # Cópia rasa para que alterações no handler não contaminem o cache.
+    return dict(entry[0])
+
+
+def store_cached_user(user: dict[str, Any]) -> None:
+    USER_CACHE[user["id"]] = (dict(user), time.monotonic() + USER_CACHE_TTL_SECONDS)
+    USER_CACHE.move_to_end(user["id"])
+    while len(USER_CACHE) > USER_CACHE_MAX_ENTRIES:
+        USER_CACHE.popitem(last=False)
+        USER_CACHE_STATS["evictions"] += 1
+
+
+def invalidate_cached_user(user_id: Optional[str] = None) -> None:
+    if user_id is None:
+        USER_CACHE.clear()
+    else:
+        USER_CACHE.pop(user_id, None)
+
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
     token = credentials.credentials
     try:
@@ -238,9 +376,13 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         user_id = payload.get("sub")
         if not user_id:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+        user = get_cached_user(user_id)
+        if user is not None:
+            return user
         user = await db.users.find_one({"id": user_id}, {"_id": 0})
         if not user:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+        store_cached_user(user)
         return user
     except JWTError as exc:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token") from exc
@@ -256,85 +398,816 @@ def extract_beneficiary_code(text: Any) -> Optional[str]:
     return None
 
 
-def calculate_installment_status(due_date_str: str, paid_date: Optional[str]) -> str:
+def fold_search_text(value: Any) -> str:
+    if not isinstance(value, str):
+        return ""
+    decomposed = unicodedata.normalize("NFKD", value)
+    folded = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(re.sub(r"[^\w\s]", " ", folded.lower()).split())
+
+
+def only_digits(value: Any) -> str:
+    if value is None:
+        return ""
+    return re.sub(r"\D", "", str(value))
+
+
+def build_case_search_fields(case: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "search_tokens": sorted(set(fold_search_text(case.get("debtor_name")).split())),
+        "cpf_digits": only_digits(case.get("cpf")),
+        "numero_processo_digits": only_digits(case.get("numero_processo")),
+        "internal_id_digits": only_digits(case.get("internal_id")),
+    }
+
+
+CASE_SEARCH_SOURCE_FIELDS = ("debtor_name", "cpf", "numero_processo", "internal_id")
+CASE_PUBLIC_PROJECTION = {
+    "_id": 0,
+    "search_tokens": 0,
+    "cpf_digits": 0,
+    "numero_processo_digits": 0,
+    "internal_id_digits": 0,
+}
+
+
+def build_case_search_filter(search: str, use_text_index: bool = False) -> Optional[dict[str, Any]]:
+    if use_text_index:
+        return {"$text": {"$search": search}}
+
+    tokens = fold_search_text(search).split()
+    digits = only_digits(search)
+    branches: list[dict[str, Any]] = []
+    if tokens:
+        branches.append({"search_tokens": {"$all": [re.compile(f"^{re.escape(token)}") for token in tokens]}})
+    if digits:
+        digits_prefix = re.compile(f"^{digits}")
+        branches.extend(
+            {field: digits_prefix}
+            for field in ("cpf_digits", "numero_processo_digits", "internal_id_digits")
+        )
+    if not branches:
+        return None
+    return {"$or": branches} if len(branches) > 1 else branches[0]
+
+
+STATUS_DESCUMPRIDO_AFTER_DAYS = 30
+
+
+def calculate_installment_status(due_date: Any, paid_date: Any) -> str:
     if paid_date:
         return "Pago"
-    due = datetime.strptime(due_date_str, "%Y-%m-%d").date()
+    due = safe_parse_date(due_date)
+    if not due:
+        return "Pendente"
     today = date.today()
     if due == today:
         return "Dia de pagamento"
     if due < today:
-        if (today - due).days > 30:
+        if (today - due).days > STATUS_DESCUMPRIDO_AFTER_DAYS:
             return "Descumprido"
         return "Atrasado"
     return "Pendente"
 
 
-async def update_case_materialized_fields(case_id: str) -> None:
-    case = await db.cases.find_one({"id": case_id}, {"_id": 0})
-    if not case:
-        return
+def get_cached_case_count(user_id: str, cache_key: str) -> Optional[tuple[int, bool]]:
+    entry = CASE_COUNT_CACHE.get(user_id, {}).get(cache_key)
+    if not entry:
+        return None
+    total, use_text_index, expires_at = entry
+    if expires_at < time.monotonic():
+        CASE_COUNT_CACHE[user_id].pop(cache_key, None)
+        return None
+    return total, use_text_index
 
-    agreement = await db.agreements.find_one({"case_id": case_id}, {"_id": 0})
-    has_agreement = bool(agreement)
 
-    installments = []
-    if agreement:
-        installments = await db.installments.find({"agreement_id": agreement["id"]}, {"_id": 0}).to_list(1000)
-        for inst in installments:
-            inst["status_calc"] = calculate_installment_status(inst["due_date"], inst.get("paid_date"))
+def store_case_count(user_id: str, cache_key: str, total: int, use_text_index: bool) -> None:
+    user_cache = CASE_COUNT_CACHE.setdefault(user_id, {})
+    if cache_key not in user_cache and len(user_cache) >= CASE_COUNT_CACHE_MAX_KEYS_PER_USER:
+        user_cache.pop(next(iter(user_cache)))
+    user_cache[cache_key] = (total, use_text_index, time.monotonic() + CASE_COUNT_CACHE_TTL_SECONDS)
+
+
+def invalidate_case_counts(user_id: Optional[str]) -> None:
+    if user_id:
+        CASE_COUNT_CACHE.pop(user_id, None)
+
+
+MATERIALIZATION_BATCH_SIZE = 500
+
+
+# Códigos ordenados por gravidade: o status do acordo é o maior código entre as parcelas.
+INSTALLMENT_STATUS_BY_CODE = ("Pago", "Pendente", "Dia de pagamento", "Atrasado", "Descumprido")
+CASE_STATUS_BY_CODE = ("Quitado", "Em andamento", "Dia de pagamento", "Em atraso", "Descumprido")
 
-    alvaras = await db.alvaras.find({"case_id": case_id}, {"_id": 0}).to_list(1000)
 
+def to_datetime64_days(values: list[Any]) -> np.ndarray:
+    # Datas BSON (datetime) e None convertem em lote pelo pandas (np.array com objetos datetime é ~10x mais lento);
+    # valores legados inválidos caem no parse item a item.
+    try:
+        return pd.Series(values, dtype="datetime64[ns]").to_numpy().astype("datetime64[D]")
+    except (ValueError, TypeError, OverflowError):
+        return np.array([safe_parse_date(value) for value in values], dtype="datetime64[D]")
+
+
+def vectorized_installment_status(due_dates: np.ndarray, paid_dates: np.ndarray, today: date) -> np.ndarray:
+    days_late = (np.datetime64(today, "D") - due_dates).astype(np.int64)
+    known_due = ~np.isnat(due_dates)
+
+    codes = np.ones(due_dates.shape, dtype=np.int8)
+    codes[known_due & (days_late == 0)] = 2
+    codes[known_due & (days_late > 0)] = 3
+    codes[known_due & (days_late > STATUS_DESCUMPRIDO_AFTER_DAYS)] = 4
+    codes[~np.isnat(paid_dates)] = 0
+    return codes
+
+
+def vectorized_next_status_change(due_dates: np.ndarray, paid_dates: np.ndarray, today: date) -> np.ndarray:
+    # Espelha calculate_installment_status: Pendente -> Dia de pagamento -> Atrasado -> Descumprido.
+    today_day = np.datetime64(today, "D")
+    next_change = np.full(due_dates.shape, np.datetime64("NaT"), dtype="datetime64[D]")
+    for offset in (STATUS_DESCUMPRIDO_AFTER_DAYS + 1, 1, 0):
+        candidate = due_dates + np.timedelta64(offset, "D")
+        next_change = np.where(candidate > today_day, candidate, next_change)
+    next_change[~np.isnat(paid_dates)] = np.datetime64("NaT")
+    return next_change
+
+
+def rollup_case_statuses(
+    case_index: np.ndarray,
+    due_dates: np.ndarray,
+    paid_dates: np.ndarray,
+    case_count: int,
+    today: date,
+) -> tuple[list[str], list[Optional[date]]]:
+    codes = vectorized_installment_status(due_dates, paid_dates, today)
+    case_codes = np.zeros(case_count, dtype=np.int8)
+    np.maximum.at(case_codes, case_index, codes)
+
+    no_change = np.iinfo(np.int64).max
+    next_change = vectorized_next_status_change(due_dates, paid_dates, today)
+    change_days = np.where(np.isnat(next_change), no_change, next_change.astype(np.int64))
+    case_change_days = np.full(case_count, no_change, dtype=np.int64)
+    np.minimum.at(case_change_days, case_index, change_days)
+
+    statuses = [CASE_STATUS_BY_CODE[code] for code in case_codes.tolist()]
+    next_changes = [
+        None if days == no_change else date.fromordinal(date(1970, 1, 1).toordinal() + days)
+        for days in case_change_days.tolist()
+    ]
+    return statuses, next_changes
+
+
+def compute_case_materialized_fields(
+    case: dict[str, Any],
+    agreement: Optional[dict[str, Any]],
+    installments: list[dict[str, Any]],
+    alvaras: list[dict[str, Any]],
+    agreement_status: str,
+    next_status_change: Optional[date],
+) -> dict[str, Any]:
     total_received = 0.0
     if agreement:
         for inst in installments:
             if inst.get("paid_date"):
-                total_received += inst.get("paid_value", 0.0)
+                total_received += inst.get("paid_value") or 0.0
 
     for alvara in alvaras:
         if alvara.get("status_alvara") == "Alvará pago":
-            total_received += alvara.get("valor_alvara", 0.0)
+            total_received += alvara.get("valor_alvara") or 0.0
 
     percent_recovered = 0.0
     if case.get("value_causa"):
         percent_recovered = (total_received / case["value_causa"]) * 100
 
-    status_acordo = ""
-    if agreement:
-        pending_count = sum(1 for i in installments if i.get("status_calc") != "Pago")
-        has_descumprido = any(i.get("status_calc") == "Descumprido" for i in installments)
-        has_atrasado = any(i.get("status_calc") == "Atrasado" for i in installments)
-        has_dia_pagamento = any(i.get("status_calc") == "Dia de pagamento" for i in installments)
-
-        if pending_count == 0:
-            status_acordo = "Quitado"
-            has_pending_alvara = any(a.get("status_alvara") == "Aguardando alvará" for a in alvaras)
-            has_paid_alvara = any(a.get("status_alvara") == "Alvará pago" for a in alvaras)
-            if has_pending_alvara:
-                await db.cases.update_one({"id": case_id}, {"$set": {"status_processo": "Aguardando alvará"}})
-            elif has_paid_alvara or not alvaras:
-                await db.cases.update_one({"id": case_id}, {"$set": {"status_processo": "Sucesso"}})
-        elif has_descumprido:
-            status_acordo = "Descumprido"
-        elif has_atrasado:
-            status_acordo = "Em atraso"
-        elif has_dia_pagamento:
-            status_acordo = "Dia de pagamento"
-        else:
-            status_acordo = "Em andamento"
-
-    await db.cases.update_one(
-        {"id": case_id},
+    fields: dict[str, Any] = {}
+    status_acordo = agreement_status if agreement else ""
+    if status_acordo == "Quitado":
+        has_pending_alvara = any(a.get("status_alvara") == "Aguardando alvará" for a in alvaras)
+        has_paid_alvara = any(a.get("status_alvara") == "Alvará pago" for a in alvaras)
+        if has_pending_alvara:
+            fields["status_processo"] = "Aguardando alvará"
+        elif has_paid_alvara or not alvaras:
+            fields["status_processo"] = "Sucesso"
+
+    fields.update(
         {
-            "$set": {
-                "has_agreement": has_agreement,
-                "status_acordo": status_acordo,
-                "total_received": round(total_received, 2),
-                "percent_recovered": round(percent_recovered, 2),
-            }
+            "has_agreement": bool(agreement),
+            "status_acordo": status_acordo,
+            "total_received": round(total_received, 2),
+            "percent_recovered": round(percent_recovered, 2),
+            "next_status_change_at": to_db_date(next_status_change) if agreement else None,
         }
     )
+    return fields
+
+
+async def recompute_cases_materialized_fields(case_ids: list[str]) -> int:
+    case_ids = list(dict.fromkeys(case_ids))
+    updated = 0
+    for offset in range(0, len(case_ids), MATERIALIZATION_BATCH_SIZE):
+        updated += await recompute_case_batch(case_ids[offset:offset + MATERIALIZATION_BATCH_SIZE])
+    return updated
+
+
+async def recompute_case_batch(case_ids: list[str]) -> int:
+    cases = await db.cases.find(
+        {"id": {"$in": case_ids}},
+        {"_id": 0, "id": 1, "user_id": 1, "value_causa": 1},
+    ).to_list(None)
+    if not cases:
+        return 0
+
+    fields_by_case = await compute_case_batch_fields(cases)
+    operations = [
+        UpdateOne({"id": case_id}, {"$set": fields, "$inc": {"version": 1}})
+        for case_id, fields in fields_by_case.items()
+    ]
+    await db.cases.bulk_write(operations, ordered=False)
+    for user_id in {case["user_id"] for case in cases}:
+        invalidate_case_counts(user_id)
+    return len(operations)
+
+
+async def compute_case_batch_fields(cases: list[dict[str, Any]]) -> dict[str, dict[str, Any]]:
+    case_ids = [case["id"] for case in cases]
+    agreements_by_case: dict[str, dict[str, Any]] = {}
+    async for agreement in db.agreements.find({"case_id": {"$in": case_ids}}, {"_id": 0, "id": 1, "case_id": 1}):
+        agreements_by_case.setdefault(agreement["case_id"], agreement)
+
+    installments_by_agreement: dict[str, list[dict[str, Any]]] = {}
+    if agreements_by_case:
+        agreement_ids = [agreement["id"] for agreement in agreements_by_case.values()]
+        async for inst in db.installments.find(
+            {"agreement_id": {"$in": agreement_ids}},
+            {"_id": 0, "agreement_id": 1, "due_date": 1, "paid_date": 1, "paid_value": 1},
+        ):
+            installments_by_agreement.setdefault(inst["agreement_id"], []).append(inst)
+
+    alvaras_by_case: dict[str, list[dict[str, Any]]] = {}
+    async for alvara in db.alvaras.find(
+        {"case_id": {"$in": case_ids}},
+        {"_id": 0, "case_id": 1, "status_alvara": 1, "valor_alvara": 1},
+    ):
+        alvaras_by_case.setdefault(alvara["case_id"], []).append(alvara)
+
+    case_index: list[int] = []
+    due_values: list[Any] = []
+    paid_values: list[Any] = []
+    for position, case in enumerate(cases):
+        agreement = agreements_by_case.get(case["id"])
+        for inst in installments_by_agreement.get(agreement["id"], []) if agreement else []:
+            case_index.append(position)
+            due_values.append(inst.get("due_date"))
+            paid_values.append(inst.get("paid_date") or None)
+
+    statuses, next_changes = rollup_case_statuses(
+        np.array(case_index, dtype=np.int64),
+        to_datetime64_days(due_values),
+        to_datetime64_days(paid_values),
+        len(cases),
+        date.today(),
+    )
+
+    fields_by_case: dict[str, dict[str, Any]] = {}
+    for position, case in enumerate(cases):
+        agreement = agreements_by_case.get(case["id"])
+        fields_by_case[case["id"]] = compute_case_materialized_fields(
+            case,
+            agreement,
+            installments_by_agreement.get(agreement["id"], []) if agreement else [],
+            alvaras_by_case.get(case["id"], []),
+            statuses[position],
+            next_changes[position],
+        )
+    return fields_by_case
+
+
+async def bump_case_versions(case_ids: list[str]) -> None:
+    # A versão alimenta o ETag do detalhe do caso; toda escrita que altera o detalhe precisa incrementá-la.
+    await db.cases.update_many({"id": {"$in": case_ids}}, {"$inc": {"version": 1}})
+
+
+async def run_case_recompute_worker() -> None:
+    while True:
+        await CASE_RECOMPUTE_WAKEUP.wait()
+        # Janela de coalescência: escritas em sequência no mesmo caso geram um único recálculo.
+        await asyncio.sleep(CASE_RECOMPUTE_DEBOUNCE_SECONDS)
+        CASE_RECOMPUTE_WAKEUP.clear()
+        await flush_case_recomputes()
+
+
+async def flush_case_recomputes(case_ids: Optional[list[str]] = None) -> None:
+    if case_ids is None:
+        pending = list(PENDING_CASE_RECOMPUTES)
+    else:
+        pending = [case_id for case_id in case_ids if case_id in PENDING_CASE_RECOMPUTES]
+    if not pending:
+        return
+    PENDING_CASE_RECOMPUTES.difference_update(pending)
+    try:
+        await recompute_cases_materialized_fields(pending)
+    except Exception:
+        logger.exception("Falha ao recalcular %s casos pendentes", len(pending))
+
+
+def enqueue_case_recompute(case_ids: list[str]) -> None:
+    PENDING_CASE_RECOMPUTES.update(case_ids)
+    CASE_RECOMPUTE_WAKEUP.set()
+
+
+async def refresh_case_fields(case_ids: list[str], sync: bool = False) -> None:
+    if sync:
+        PENDING_CASE_RECOMPUTES.difference_update(case_ids)
+        await recompute_cases_materialized_fields(case_ids)
+    else:
+        # Incrementa a versão já na escrita para o ETag não ficar defasado enquanto o recálculo está na fila.
+        await bump_case_versions(case_ids)
+        enqueue_case_recompute(case_ids)
+
+
+async def refresh_due_case_statuses() -> int:
+    today = to_db_date(date.today())
+    query = {
+        "$or": [
+            {"next_status_change_at": {"$lte": today}},
+            {"has_agreement": True, "next_status_change_at": {"$exists": False}},
+        ]
+    }
+    refreshed = 0
+    batch: list[str] = []
+    async for case in db.cases.find(query, {"_id": 0, "id": 1}):
+        batch.append(case["id"])
+        if len(batch) >= MATERIALIZATION_BATCH_SIZE:
+            refreshed += await recompute_cases_materialized_fields(batch)
+            batch = []
+    if batch:
+        refreshed += await recompute_cases_materialized_fields(batch)
+    return refreshed
+
+
+async def run_status_refresh_scheduler() -> None:
+    while True:
+        try:
+            refreshed = await refresh_due_case_statuses()
+            if refreshed:
+                logger.info("Status refresh: %s cases recomputed", refreshed)
+        except Exception:
+            logger.exception("Falha na atualização diária de status")
+
+        now = datetime.now()
+        next_run = datetime.combine(now.date() + timedelta(days=1), datetime.min.time()) + timedelta(minutes=1)
+        await asyncio.sleep((next_run - now).total_seconds())
+
+
+LEDGER_ENTRY_FIELDS = ("date", "type", "value", "beneficiario", "observacoes")
+
+
+def ledger_month(value: Any) -> str:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()[:7]
+    return str(value)[:7]
+
+
+def build_ledger_entries(
+    case: dict[str, Any],
+    installments: list[dict[str, Any]],
+    alvaras: list[dict[str, Any]],
+) -> dict[tuple[str, str], dict[str, Any]]:
+    entries: dict[tuple[str, str], dict[str, Any]] = {}
+
+    for inst in installments:
+        paid_date = safe_parse_date(inst.get("paid_date"))
+        if not paid_date:
+            continue
+        label = "Entrada" if inst.get("is_entry") else "Parcela"
+        number = inst.get("number")
+        entries[("installment", inst["id"])] = {
+            "user_id": case["user_id"],
+            "case_id": case["id"],
+            "source_type": "installment",
+            "source_id": inst["id"],
+            "date": to_db_date(paid_date),
+            "type": label,
+            "value": inst.get("paid_value") or 0.0,
+            "beneficiario": case.get("polo_ativo_codigo"),
+            "observacoes": f"{label} #{number if number is not None else ''}",
+        }
+
+    for alvara in alvaras:
+        if alvara.get("status_alvara") != "Alvará pago":
+            continue
+        alvara_date = safe_parse_date(alvara.get("data_alvara"))
+        if not alvara_date:
+            continue
+        entries[("alvara", alvara["id"])] = {
+            "user_id": case["user_id"],
+            "case_id": case["id"],
+            "source_type": "alvara",
+            "source_id": alvara["id"],
+            "date": to_db_date(alvara_date),
+            "type": "Alvará Judicial",
+            "value": alvara.get("valor_alvara") or 0.0,
+            "beneficiario": alvara.get("beneficiario_codigo"),
+            "observacoes": alvara.get("observacoes") or "",
+        }
+
+    return entries
+
+
+async def sync_receipts_ledger(case_ids: list[str]) -> None:
+    case_ids = list(dict.fromkeys(case_ids))
+    if not case_ids:
+        return
+
+    cases = await db.cases.find(
+        {"id": {"$in": case_ids}},
+        {"_id": 0, "id": 1, "user_id": 1, "polo_ativo_codigo": 1},
+    ).to_list(None)
+    # Junta pelo acordo: parcelas legadas podem ainda não ter case_id preenchido pelo backfill.
+    agreement_cases = {
+        agreement["id"]: agreement["case_id"]
+        async for agreement in db.agreements.find(
+            {"case_id": {"$in": case_ids}}, {"_id": 0, "id": 1, "case_id": 1}
+        )
+    }
+    installments_by_case: dict[str, list[dict[str, Any]]] = {}
+    if agreement_cases:
+        async for inst in db.installments.find(
+            {"agreement_id": {"$in": list(agreement_cases)}, "paid_date": {"$ne": None}},
+            {"_id": 0, "id": 1, "agreement_id": 1, "is_entry": 1, "number": 1, "paid_date": 1, "paid_value": 1},
+        ):
+            installments_by_case.setdefault(agreement_cases[inst["agreement_id"]], []).append(inst)
+
+    alvaras_by_case: dict[str, list[dict[str, Any]]] = {}
+    alvaras = await db.alvaras.find(
+        {"case_id": {"$in": case_ids}, "status_alvara": "Alvará pago"},
+        {"_id": 0},
+    ).to_list(None)
+    for alvara in alvaras:
+        alvaras_by_case.setdefault(alvara["case_id"], []).append(alvara)
+
+    desired: dict[tuple[str, str], dict[str, Any]] = {}
+    for case in cases:
+        desired.update(
+            build_ledger_entries(
+                case,
+                installments_by_case.get(case["id"], []),
+                alvaras_by_case.get(case["id"], []),
+            )
+        )
+
+    active_entries = await db.receipts_ledger.find(
+        {"case_id": {"$in": case_ids}, "reversed_at": None},
+        {"_id": 0},
+    ).to_list(None)
+
+    # O ledger é append-only: lançamentos alterados são estornados e relançados.
+    now = datetime.now(timezone.utc).isoformat()
+    operations: list[Any] = []
+    monthly_deltas: dict[tuple[str, str, Optional[str], str], list[float]] = {}
+
+    def add_monthly_delta(entry: dict[str, Any], sign: int) -> None:
+        key = (entry["user_id"], ledger_month(entry["date"]), entry.get("beneficiario"), entry["type"])
+        delta = monthly_deltas.setdefault(key, [0.0, 0])
+        delta[0] += sign * (entry.get("value") or 0.0)
+        delta[1] += sign
+
+    stale_entries: dict[str, dict[str, Any]] = {}
+    for entry in active_entries:
+        key = (entry["source_type"], entry["source_id"])
+        wanted = desired.get(key)
+        if wanted and all(entry.get(field) == wanted[field] for field in LEDGER_ENTRY_FIELDS):
+            desired.pop(key)
+            continue
+        stale_entries[entry["id"]] = entry
+
+    if stale_entries:
+        # Só desconta do rollup o estorno que de fato aconteceu: syncs concorrentes podem disputar a mesma entrada.
+        reversal_id = str(uuid.uuid4())
+        stale_ids = list(stale_entries)
+        await db.receipts_ledger.update_many(
+            {"id": {"$in": stale_ids}, "reversed_at": None},
+            {"$set": {"reversed_at": now, "active": False, "reversal_id": reversal_id}},
+        )
+        async for reversed_entry in db.receipts_ledger.find(
+            {"id": {"$in": stale_ids}, "reversal_id": reversal_id}, {"_id": 0, "id": 1}
+        ):
+            add_monthly_delta(stale_entries[reversed_entry["id"]], -1)
+
+    pending = list(desired.values())
+    for wanted in pending:
+        operations.append(
+            InsertOne({"id": str(uuid.uuid4()), **wanted, "created_at": now, "reversed_at": None, "active": True})
+        )
+
+    failed: set[int] = set()
+    if operations:
+        try:
+            await db.receipts_ledger.bulk_write(operations, ordered=False)
+        except BulkWriteError as exc:
+            # Índice único parcial: outro sync concorrente já lançou a mesma origem.
+            errors = exc.details.get("writeErrors", [])
+            if any(error.get("code") != 11000 for error in errors):
+                raise
+            failed = {error["index"] for error in errors}
+    for index, wanted in enumerate(pending):
+        if index not in failed:
+            add_monthly_delta(wanted, 1)
+
+    monthly_operations = [
+        UpdateOne(
+            {"user_id": user_id, "month": month, "beneficiario": beneficiario, "type": receipt_type},
+            {"$inc": {"total": round(total, 2), "count": count}},
+            upsert=True,
+        )
+        for (user_id, month, beneficiario, receipt_type), (total, count) in monthly_deltas.items()
+        if total or count
+    ]
+    if monthly_operations:
+        await db.receipts_monthly.bulk_write(monthly_operations, ordered=False)
+
+
+async def rebuild_receipts_ledger(batch_size: int = 500) -> int:
+    await db.receipts_ledger.delete_many({})
+    await db.receipts_monthly.delete_many({})
+
+    processed = 0
+    batch: list[str] = []
+    async for case in db.cases.find({}, {"_id": 0, "id": 1}):
+        batch.append(case["id"])
+        if len(batch) >= batch_size:
+            await sync_receipts_ledger(batch)
+            processed += len(batch)
+            batch = []
+    if batch:
+        await sync_receipts_ledger(batch)
+        processed += len(batch)
+    return processed
+
+
+# v2: lançamentos ganharam a flag "active" do índice único; a reconstrução também desfaz duplicatas antigas.
+RECEIPTS_LEDGER_MIGRATION = "receipts_ledger_rebuild_v2"
+
+NATIVE_DATE_FIELDS: dict[str, tuple[str, ...]] = {
+    "installments": ("due_date", "paid_date"),
+    "alvaras": ("data_alvara",),
+    "receipts_ledger": ("date",),
+}
+
+
+async def migrate_native_dates(batch_size: int = 1000) -> dict[str, int]:
+    migrated: dict[str, int] = {}
+
+    async def flush(collection: Any, operations: list[Any]) -> int:
+        if not operations:
+            return 0
+        await collection.bulk_write(operations, ordered=False)
+        return len(operations)
+
+    for collection_name, fields in NATIVE_DATE_FIELDS.items():
+        collection = db[collection_name]
+        for field in fields:
+            count = 0
+            operations: list[Any] = []
+            async for document in collection.find({field: {"$type": "string"}}, {"_id": 1, field: 1}):
+                raw_value = document[field]
+                new_value = to_db_date(raw_value)
+                if new_value is None and raw_value.strip():
+                    continue
+                operations.append(UpdateOne({"_id": document["_id"]}, {"$set": {field: new_value}}))
+                if len(operations) >= batch_size:
+                    count += await flush(collection, operations)
+                    operations = []
+            count += await flush(collection, operations)
+            migrated[f"{collection_name}.{field}"] = count
+
+    # alvaras.created_at foi gravado ora como datetime, ora como string ISO.
+    count = 0
+    operations = []
+    async for document in db.alvaras.find({"created_at": {"$type": "string"}}, {"_id": 1, "created_at": 1}):
+        try:
+            created_at = datetime.fromisoformat(document["created_at"])
+        except ValueError:
+            continue
+        operations.append(UpdateOne({"_id": document["_id"]}, {"$set": {"created_at": created_at}}))
+        if len(operations) >= batch_size:
+            count += await flush(db.alvaras, operations)
+            operations = []
+    count += await flush(db.alvaras, operations)
+    migrated["alvaras.created_at"] = count
+
+    if any(migrated.values()):
+        logger.info("Native date migration: %s", migrated)
+    return migrated
+
+
+async def backfill_installment_scope(batch_size: int = 1000) -> int:
+    agreement_ids = await db.installments.distinct("agreement_id", {"user_id": {"$exists": False}})
+    updated = 0
+    for offset in range(0, len(agreement_ids), batch_size):
+        batch = agreement_ids[offset:offset + batch_size]
+        agreements = await db.agreements.find(
+            {"id": {"$in": batch}},
+            {"_id": 0, "id": 1, "case_id": 1},
+        ).to_list(None)
+        cases = await db.cases.find(
+            {"id": {"$in": [agreement["case_id"] for agreement in agreements]}},
+            {"_id": 0, "id": 1, "user_id": 1},
+        ).to_list(None)
+        case_users = {case["id"]: case["user_id"] for case in cases}
+
+        operations = [
+            UpdateMany(
+                {"agreement_id": agreement["id"], "user_id": {"$exists": False}},
+                {"$set": {"case_id": agreement["case_id"], "user_id": case_users[agreement["case_id"]]}},
+            )
+            for agreement in agreements
+            if agreement["case_id"] in case_users
+        ]
+        if operations:
+            result = await db.installments.bulk_write(operations, ordered=False)
+            updated += result.modified_count
+
+    if updated:
+        logger.info("Installment scope backfill: %s installments updated", updated)
+    return updated
+
+
+async def backfill_alvara_user_ids(batch_size: int = 1000) -> int:
+    case_ids = await db.alvaras.distinct("case_id", {"user_id": {"$exists": False}})
+    updated = 0
+    for offset in range(0, len(case_ids), batch_size):
+        cases = await db.cases.find(
+            {"id": {"$in": case_ids[offset:offset + batch_size]}},
+            {"_id": 0, "id": 1, "user_id": 1},
+        ).to_list(None)
+        operations = [
+            UpdateMany(
+                {"case_id": case["id"], "user_id": {"$exists": False}},
+                {"$set": {"user_id": case["user_id"]}},
+            )
+            for case in cases
+        ]
+        if operations:
+            result = await db.alvaras.bulk_write(operations, ordered=False)
+            updated += result.modified_count
+
+    if updated:
+        logger.info("Alvara user backfill: %s alvaras updated", updated)
+    return updated
+
+
+async def backfill_case_search_fields(batch_size: int = 1000) -> int:
+    updated = 0
+    operations: list[Any] = []
+    projection = {"_id": 1, **{field: 1 for field in CASE_SEARCH_SOURCE_FIELDS}}
+    async for case in db.cases.find({"search_tokens": {"$exists": False}}, projection):
+        operations.append(UpdateOne({"_id": case["_id"]}, {"$set": build_case_search_fields(case)}))
+        if len(operations) >= batch_size:
+            await db.cases.bulk_write(operations, ordered=False)
+            updated += len(operations)
+            operations = []
+    if operations:
+        await db.cases.bulk_write(operations, ordered=False)
+        updated += len(operations)
+
+    # search_name não é consultado: a busca por nome usa só search_tokens.
+    await db.cases.update_many({"search_name": {"$exists": True}}, {"$unset": {"search_name": ""}})
+
+    if updated:
+        logger.info("Case search backfill: %s cases updated", updated)
+    return updated
+
+
+async def run_startup_migrations() -> None:
+    await migrate_native_dates()
+    await backfill_installment_scope()
+    await backfill_alvara_user_ids()
+    await backfill_case_search_fields()
+    # Marcador em vez de "ledger vazio": escritas feitas durante os backfills já sincronizam alguns casos.
+    if not await db.migrations.find_one({"id": RECEIPTS_LEDGER_MIGRATION}):
+        await rebuild_receipts_ledger()
+        await db.migrations.update_one(
+            {"id": RECEIPTS_LEDGER_MIGRATION},
+            {"$set": {"completed_at": datetime.now(timezone.utc)}},
+            upsert=True,
+        )
+
+
+def build_installment_record(
+    agreement_id: str,
+    case_id: str,
+    user_id: str,
+    number: Optional[int],
+    due_date: Any,
+    is_entry: bool = False,
+    paid_date: Any = None,
+    paid_value: Optional[float] = None,
+) -> dict[str, Any]:
+    return {
+        "id": str(uuid.uuid4()),
+        "agreement_id": agreement_id,
+        "case_id": case_id,
+        "user_id": user_id,
+        "is_entry": is_entry,
+        "number": number,
+        "due_date": to_db_date(due_date),
+        "paid_date": to_db_date(paid_date),
+        "paid_value": paid_value,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def compute_monthly_due_dates(first_due: date, count: int) -> np.ndarray:
+    # Aritmética em datetime64[M]; o dia é limitado ao último dia de cada mês (31/01 -> 29/02 -> 31/03).
+    months = np.datetime64(first_due, "M") + np.arange(count)
+    month_starts = months.astype("datetime64[D]")
+    month_lengths = ((months + 1).astype("datetime64[D]") - month_starts).astype(np.int64)
+    day_offsets = np.minimum(first_due.day - 1, month_lengths - 1)
+    return month_starts + day_offsets.astype("timedelta64[D]")
+
+
+def build_installment_schedule(
+    agreement_id: str,
+    case_id: str,
+    user_id: str,
+    first_due_date: str,
+    installments_count: int,
+    has_entry: bool = False,
+    entry_date: Optional[str] = None,
+) -> list[dict[str, Any]]:
+    schedule: list[dict[str, Any]] = []
+    if has_entry:
+        schedule.append(build_installment_record(agreement_id, case_id, user_id, None, entry_date, is_entry=True))
+
+    # Parcelas mensais (mês calendário)
+    first_due = datetime.strptime(first_due_date, "%Y-%m-%d").date()
+    due_dates = compute_monthly_due_dates(first_due, installments_count).astype(datetime)
+    for number, due_date in enumerate(due_dates, start=1):
+        schedule.append(build_installment_record(agreement_id, case_id, user_id, number, due_date))
+    return schedule
+
+
+async def insert_installments(installments: list[dict[str, Any]], session: Any = None) -> int:
+    for offset in range(0, len(installments), INSTALLMENT_INSERT_BATCH_SIZE):
+        await db.installments.insert_many(
+            installments[offset:offset + INSTALLMENT_INSERT_BATCH_SIZE], session=session
+        )
+    return len(installments)
+
+
+def diff_installment_schedule(
+    existing: list[dict[str, Any]],
+    desired: list[dict[str, Any]],
+    drop_unpaid_entries: bool = False,
+) -> list[Any]:
+    # Casa parcelas pelo número: mantém ids, altera só vencimentos diferentes, insere a cauda e remove o excedente.
+    desired_by_number = {inst["number"]: inst for inst in desired if not inst.get("is_entry")}
+    operations: list[Any] = []
+    surplus_ids: list[str] = []
+    matched: set[int] = set()
+    for inst in existing:
+        if inst.get("paid_date"):
+            continue
+        if inst.get("is_entry"):
+            if drop_unpaid_entries:
+                surplus_ids.append(inst["id"])
+            continue
+        number = inst.get("number")
+        target = desired_by_number.get(number)
+        if target is None or number in matched:
+            surplus_ids.append(inst["id"])
+            continue
+        matched.add(number)
+        if to_db_date(inst.get("due_date")) != target["due_date"]:
+            operations.append(UpdateOne({"id": inst["id"]}, {"$set": {"due_date": target["due_date"]}}))
+
+    operations.extend(InsertOne(inst) for number, inst in desired_by_number.items() if number not in matched)
+    if surplus_ids:
+        operations.append(DeleteMany({"id": {"$in": surplus_ids}}))
+    return operations
+
+
+async def mongo_supports_transactions() -> bool:
+    global MONGO_TRANSACTIONS_SUPPORTED
+    if MONGO_TRANSACTIONS_SUPPORTED is None:
+        try:
+            hello = await client.admin.command("hello")
+            # Transações exigem replica set (setName) ou mongos (isdbgrid).
+            MONGO_TRANSACTIONS_SUPPORTED = bool(hello.get("setName")) or hello.get("msg") == "isdbgrid"
+        except Exception:
+            logger.exception("Falha ao detectar suporte a transações")
+            MONGO_TRANSACTIONS_SUPPORTED = False
+    return MONGO_TRANSACTIONS_SUPPORTED
+
+
+async def run_in_transaction(operation: Any) -> None:
+    if not await mongo_supports_transactions():
+        await operation(None)
+        return
+    async with await client.start_session() as session:
+        await session.with_transaction(operation)
 
 
 def normalize_import_value(value: Any) -> Any:
@@ -450,14 +1323,67 @@ async def ensure_indexes() -> None:
     await db.cases.create_index([("user_id", 1), ("status_acordo", 1)])
     await db.cases.create_index([("user_id", 1), ("has_agreement", 1)])
     await db.cases.create_index([("user_id", 1), ("created_at", -1)])
+    await db.cases.create_index("id")
+    for sort_field in dict.fromkeys(field for field, _ in CASES_SORT_MAPPING.values()):
+        await db.cases.create_index([("user_id", 1), (sort_field, 1), ("id", 1)])
+    for search_field in ("search_tokens", "cpf_digits", "numero_processo_digits", "internal_id_digits"):
+        await db.cases.create_index([("user_id", 1), (search_field, 1)])
+    await db.cases.create_index(
+        [("user_id", 1), ("debtor_name", "text")],
+        default_language="portuguese",
+        name="cases_debtor_name_text",
+    )
+    await db.agreements.create_index("id")
+    await db.agreements.create_index("case_id")
+    await db.installments.create_index("paid_date")
+    await db.installments.create_index("due_date")
+    await db.installments.create_index("agreement_id")
+    await db.installments.create_index("case_id")
+    await db.installments.create_index([("user_id", 1), ("paid_date", 1)])
+    await db.installments.create_index([("user_id", 1), ("due_date", 1), ("paid_date", 1)])
+    await db.alvaras.create_index([("status_alvara", 1), ("data_alvara", 1)])
+    await db.alvaras.create_index([("user_id", 1), ("status_alvara", 1), ("data_alvara", 1)])
+    await db.alvaras.create_index([("user_id", 1), ("data_alvara", -1), ("id", -1)])
+    await db.alvaras.create_index("case_id")
+    await db.receipts_ledger.create_index([("user_id", 1), ("date", 1)])
+    await db.receipts_ledger.create_index([("user_id", 1), ("date", -1), ("id", -1)])
+    await db.receipts_ledger.create_index([("user_id", 1), ("beneficiario", 1), ("date", 1)])
+    await db.receipts_ledger.create_index([("case_id", 1), ("reversed_at", 1)])
+    await db.receipts_ledger.create_index("id", unique=True)
+    await db.receipts_ledger.create_index(
+        [("source_type", 1), ("source_id", 1)],
+        unique=True,
+        partialFilterExpression={"active": True},
+        name="receipts_ledger_active_source",
+    )
+    await db.receipts_monthly.create_index(
+        [("user_id", 1), ("month", 1), ("beneficiario", 1), ("type", 1)], unique=True
+    )
+
+    await db.cases.create_index("next_status_change_at")
+
+    for job in (run_startup_migrations(), run_status_refresh_scheduler(), run_case_recompute_worker()):
+        BACKGROUND_TASKS.add(asyncio.create_task(job))
+
+
+@app.on_event("shutdown")
+async def shutdown_background_work() -> None:
+    await flush_case_recomputes()
+    for task in BACKGROUND_TASKS:
+        task.cancel()
+    await asyncio.gather(*BACKGROUND_TASKS, return_exceptions=True)
+    BACKGROUND_TASKS.clear()
+    PASSWORD_EXECUTOR.shutdown(wait=False)
 
 
 @api_router.post("/auth/login")
 async def login(credentials: UserLogin):
     user = await db.users.find_one({"email": credentials.email}, {"_id": 0})
-    if not user or not verify_password(credentials.password, user.get("password", "")):
+    if not user or not await verify_password_async(credentials.password, user.get("password", "")):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
 
+    # Login lê o documento atualizado do banco; descarta a versão em cache.
+    invalidate_cached_user(user["id"])
     access_token = create_access_token({"sub": user["id"]})
     return {"token": access_token}
 
@@ -467,6 +1393,19 @@ async def get_me(current_user: dict = Depends(get_current_user)):
     return User(**current_user)
 
 
+@api_router.get("/auth/cache-stats")
+async def get_user_cache_stats(current_user: dict = Depends(get_current_user)):
+    # Contadores do processo inteiro: restritos a administradores.
+    if current_user.get("role") != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Acesso restrito")
+    lookups = USER_CACHE_STATS["hits"] + USER_CACHE_STATS["misses"]
+    return {
+        **USER_CACHE_STATS,
+        "size": len(USER_CACHE),
+        "hit_rate": round(USER_CACHE_STATS["hits"] / lookups, 4) if lookups else 0.0,
+    }
+
+
 @api_router.post("/cases", response_model=Case)
 async def create_case(case_data: CaseCreate, current_user: dict = Depends(get_current_user)):
     case = Case(
@@ -481,27 +1420,38 @@ async def create_case(case_data: CaseCreate, current_user: dict = Depends(get_cu
         percent_recovered=0.0
     )
 
-    await db.cases.insert_one(case.model_dump())
+    case_document = case.model_dump()
+    await db.cases.insert_one({**case_document, **build_case_search_fields(case_document), "version": 1})
+    invalidate_case_counts(current_user["id"])
     return case
 
 
-@api_router.get("/cases")
-async def get_cases(
+CASES_SORT_MAPPING: dict[str, tuple[str, int]] = {
+    "recent": ("created_at", -1),
+    "debtor_name_asc": ("debtor_name", 1),
+    "value_causa_asc": ("value_causa", 1),
+    "value_causa_desc": ("value_causa", -1),
+    "total_received_asc": ("total_received", 1),
+    "total_received_desc": ("total_received", -1),
+    "percent_recovered_asc": ("percent_recovered", 1),
+    "percent_recovered_desc": ("percent_recovered", -1),
+}
+
+
+def build_cases_query(
+    user_id: str,
     search: Optional[str] = None,
     status_acordo: Optional[str] = None,
     has_agreement: Optional[bool] = None,
     beneficiario: Optional[str] = None,
     status_processo: Optional[str] = None,
-    sort_by: Optional[str] = None,
-    sort_order: Optional[str] = None,    
-    page: int = 1,
-    limit: int = 10,
-    current_user: dict = Depends(get_current_user)
-):
-    query = {"user_id": current_user["id"]}
+    use_text_index: bool = False,
+) -> dict[str, Any]:
+    query: dict[str, Any] = {"user_id": user_id}
 
-    if search:
-        query["debtor_name"] = {"$regex": search, "$options": "i"}
+    search_filter = build_case_search_filter(search, use_text_index) if search else None
+    if search_filter:
+        query.update(search_filter)
     if status_acordo:
         query["status_acordo"] = status_acordo
     if has_agreement is not None:
@@ -510,43 +1460,130 @@ async def get_cases(
         query["polo_ativo_codigo"] = beneficiario
     if status_processo:
         query["status_processo"] = status_processo
+    return query
+
+
+def resolve_cases_sort(sort_by: Optional[str], sort_order: Optional[str]) -> str:
+    if not sort_by:
+        return "recent"
+    normalized_sort_by = sort_by.strip().lower()
+    normalized_sort_order = (sort_order or "").strip().lower()
+    sort_key = normalized_sort_by
+    if normalized_sort_by != "recent" and not normalized_sort_by.endswith(("_asc", "_desc")):
+        if normalized_sort_order in {"asc", "desc"}:
+            sort_key = f"{normalized_sort_by}_{normalized_sort_order}"
+    return sort_key if sort_key in CASES_SORT_MAPPING else "recent"
+
+
+async def count_cases(query: dict[str, Any], cap: Optional[int]) -> tuple[int, bool]:
+    if cap is None:
+        return await db.cases.count_documents(query), True
+    total = await db.cases.count_documents(query, limit=cap)
+    return total, total < cap
+
+
+async def resolve_cases_count(
+    user_id: str,
+    filters: dict[str, Any],
+    estimate_cap: Optional[int] = None,
+) -> tuple[dict[str, Any], int, bool]:
+    cache_key = json.dumps(filters, sort_keys=True)
+    cached = get_cached_case_count(user_id, cache_key)
+    if cached:
+        total, use_text_index = cached
+        return build_cases_query(user_id, **filters, use_text_index=use_text_index), total, True
+
+    query = build_cases_query(user_id, **filters)
+    total, exact = await count_cases(query, estimate_cap)
+    use_text_index = False
+    if not total and filters.get("search"):
+        # Sem resultados por prefixo: recorre ao índice de texto (palavras fora de ordem, flexões).
+        text_query = build_cases_query(user_id, **filters, use_text_index=True)
+        text_total, text_exact = await count_cases(text_query, estimate_cap)
+        if text_total:
+            query, total, exact, use_text_index = text_query, text_total, text_exact, True
+
+    if exact:
+        store_case_count(user_id, cache_key, total, use_text_index)
+    return query, total, exact
+
+
+def build_keyset_filter(field: str, direction: int, value: Any, last_id: str) -> dict[str, Any]:
+    # MongoDB ordena null/ausente antes de qualquer valor: primeiro no asc, por último no desc.
+    id_operator = "$gt" if direction == 1 else "$lt"
+    if value is None:
+        same_value = {field: None, "id": {id_operator: last_id}}
+        if direction == 1:
+            return {"$or": [same_value, {field: {"$ne": None}}]}
+        return same_value
 
-    sort_mapping = {
-        "recent": ("created_at", -1),
-        "debtor_name_asc": ("debtor_name", 1),
-        "value_causa_asc": ("value_causa", 1),
-        "value_causa_desc": ("value_causa", -1),
-        "total_received_asc": ("total_received", 1),
-        "total_received_desc": ("total_received", -1),
-        "percent_recovered_asc": ("percent_recovered", 1),
-        "percent_recovered_desc": ("percent_recovered", -1),
-    }
+    value_operator = "$gt" if direction == 1 else "$lt"
+    branches: list[dict[str, Any]] = [
+        {field: {value_operator: value}},
+        {field: value, "id": {id_operator: last_id}},
+    ]
+    if direction == -1:
+        branches.append({field: None})
+    return {"$or": branches}
+
+
+@api_router.get("/cases")
+async def get_cases(
+    search: Optional[str] = None,
+    status_acordo: Optional[str] = None,
+    has_agreement: Optional[bool] = None,
+    beneficiario: Optional[str] = None,
+    status_processo: Optional[str] = None,
+    sort_by: Optional[str] = None,
+    sort_order: Optional[str] = None,    
+    page: int = 1,
+    limit: int = 10,
+    after: Optional[str] = None,
+    estimate: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    sort_key = resolve_cases_sort(sort_by, sort_order)
+    sort_field, sort_direction = CASES_SORT_MAPPING[sort_key]
+    sort_spec = [(sort_field, sort_direction), ("id", sort_direction)]
 
-    sort_field = "created_at"
-    sort_direction = -1
-    if sort_by:
-        normalized_sort_by = sort_by.strip().lower()
-        normalized_sort_order = (sort_order or "").strip().lower()
-        sort_key = normalized_sort_by
-        if normalized_sort_by != "recent" and not normalized_sort_by.endswith(("_asc", "_desc")):
-            if normalized_sort_order in {"asc", "desc"}:
-                sort_key = f"{normalized_sort_by}_{normalized_sort_order}"
-        if sort_key in sort_mapping:
-            sort_field, sort_direction = sort_mapping[sort_key]
-            
     safe_page = max(page, 1)
     safe_limit = max(limit, 1)
-    skip = (safe_page - 1) * safe_limit
 
-    total = await db.cases.count_documents(query)
+    # Com estimate=true a contagem para no limite de algumas páginas; o total exato vem de /cases/count.
+    estimate_cap = safe_page * safe_limit + safe_limit * CASE_COUNT_ESTIMATE_PAGES if estimate else None
+    filters = {
+        "search": search,
+        "status_acordo": status_acordo,
+        "has_agreement": has_agreement,
+        "beneficiario": beneficiario,
+        "status_processo": status_processo,
+    }
+    query, total, total_exact = await resolve_cases_count(current_user["id"], filters, estimate_cap)
+
+    if after:
+        # Paginação por cursor: o token carrega a chave de ordenação e o id do último caso.
+        token_sort_key, last_value, last_id = decode_cursor(after, 3)
+        if token_sort_key != sort_key:
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+        page_query = {"$and": [query, build_keyset_filter(sort_field, sort_direction, last_value, last_id)]}
+        skip = 0
+    else:
+        page_query = query
+        skip = (safe_page - 1) * safe_limit
+
     cases = await (
-        db.cases.find(query, {"_id": 0})
-        .sort(sort_field, sort_direction)
+        db.cases.find(page_query, CASE_PUBLIC_PROJECTION)
+        .sort(sort_spec)
         .skip(skip)
-        .limit(safe_limit)
-        .to_list(safe_limit)
+        .limit(safe_limit + 1)
+        .to_list(safe_limit + 1)
     )
-    
+
+    next_cursor = None
+    if len(cases) > safe_limit:
+        cases = cases[:safe_limit]
+        next_cursor = encode_cursor([sort_key, cases[-1].get(sort_field), cases[-1]["id"]])
+
     result = []
     for case in cases:
         result.append({
@@ -564,10 +1601,87 @@ async def get_cases(
             "page": safe_page,
             "limit": safe_limit,
             "total": total,
-            "total_pages": total_pages
+            "total_exact": total_exact,
+            "total_pages": total_pages,
+            "next_cursor": next_cursor,
         }
     }
 
+
+@api_router.get("/cases/count")
+async def get_cases_count(
+    search: Optional[str] = None,
+    status_acordo: Optional[str] = None,
+    has_agreement: Optional[bool] = None,
+    beneficiario: Optional[str] = None,
+    status_processo: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    filters = {
+        "search": search,
+        "status_acordo": status_acordo,
+        "has_agreement": has_agreement,
+        "beneficiario": beneficiario,
+        "status_processo": status_processo,
+    }
+    _, total, _ = await resolve_cases_count(current_user["id"], filters)
+    return {"total": total}
+
+
+CASE_FACET_FIELDS = ("status_acordo", "has_agreement", "polo_ativo_codigo", "status_processo")
+
+
+def build_case_bucket_stages(group_key: Any) -> list[dict[str, Any]]:
+    return [
+        {
+            "$group": {
+                "_id": group_key,
+                "count": {"$sum": 1},
+                "value_causa": {"$sum": {"$ifNull": ["$value_causa", 0]}},
+                "total_received": {"$sum": {"$ifNull": ["$total_received", 0]}},
+            }
+        },
+        {"$sort": {"count": -1}},
+        {"$addFields": {"value": "$_id"}},
+        {"$project": {"_id": 0}},
+    ]
+
+
+@api_router.get("/cases/facets")
+async def get_cases_facets(
+    search: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    filters = {
+        "search": search,
+        "status_acordo": None,
+        "has_agreement": None,
+        "beneficiario": None,
+        "status_processo": None,
+    }
+    # Uma ida ao banco: reaproveita a decisão de índice de texto do cache de contagem, se houver,
+    # e só recorre ao índice de texto quando a busca por prefixo não encontra nada.
+    cached = get_cached_case_count(current_user["id"], json.dumps(filters, sort_keys=True))
+    use_text_index = bool(cached and cached[1])
+
+    facets = {field: build_case_bucket_stages(f"${field}") for field in CASE_FACET_FIELDS}
+    facets["totals"] = build_case_bucket_stages(None)
+
+    async def load_buckets(text_index: bool) -> dict[str, Any]:
+        query = build_cases_query(current_user["id"], **filters, use_text_index=text_index)
+        result = await db.cases.aggregate([{"$match": query}, {"$facet": facets}]).to_list(1)
+        return result[0] if result else {}
+
+    buckets = await load_buckets(use_text_index)
+    if search and not use_text_index and not buckets.get("totals"):
+        buckets = await load_buckets(True)
+
+    totals = (buckets.get("totals") or [{"count": 0, "value_causa": 0.0, "total_received": 0.0}])[0]
+    totals.pop("value", None)
+    response: dict[str, Any] = {field: buckets.get(field, []) for field in CASE_FACET_FIELDS}
+    response["totals"] = totals
+    return response
+
 @api_router.put("/cases/bulk-update")
 async def bulk_update_cases(payload: CaseBulkUpdateRequest, current_user: dict = Depends(get_current_user)):
     if not payload.case_ids:
@@ -589,17 +1703,22 @@ async def bulk_update_cases(payload: CaseBulkUpdateRequest, current_user: dict =
     if not case_ids:
         return {"updated": 0}
 
-    await db.cases.update_many({"id": {"$in": case_ids}}, {"$set": update_data})
+    await db.cases.update_many({"id": {"$in": case_ids}}, {"$set": update_data, "$inc": {"version": 1}})
+
+    await recompute_cases_materialized_fields(case_ids)
 
-    for case_id in case_ids:
-        await update_case_materialized_fields(case_id)
+    if "polo_ativo_codigo" in update_data:
+        await sync_receipts_ledger(case_ids)
 
     if "status_acordo" in update_data:
-        for case_id in case_ids:
-            agreement = await db.agreements.find_one({"case_id": case_id}, {"_id": 0, "id": 1})
-            if not agreement:
-                await db.cases.update_one({"id": case_id}, {"$set": {"status_acordo": update_data["status_acordo"]}})
+        # Sem acordo o status é manual: recomputar zera o campo, então reaplicamos o valor informado.
+        case_ids_with_agreement = await db.agreements.distinct("case_id", {"case_id": {"$in": case_ids}})
+        await db.cases.update_many(
+            {"id": {"$in": case_ids, "$nin": case_ids_with_agreement}},
+            {"$set": {"status_acordo": update_data["status_acordo"]}, "$inc": {"version": 1}},
+        )
 
+    invalidate_case_counts(current_user["id"])
     return {"updated": len(case_ids)}
 
 
@@ -629,42 +1748,157 @@ async def bulk_delete_cases(payload: CaseBulkDeleteRequest, current_user: dict =
 
     await db.alvaras.delete_many({"case_id": {"$in": case_ids}})
     delete_result = await db.cases.delete_many({"id": {"$in": case_ids}, "user_id": current_user["id"]})
+    invalidate_case_counts(current_user["id"])
+    await sync_receipts_ledger(case_ids)
     return {"deleted": delete_result.deleted_count}
 
 
-@api_router.get("/cases/{case_id}")
-async def get_case(case_id: str, current_user: dict = Depends(get_current_user)):
-    case = await db.cases.find_one({"id": case_id, "user_id": current_user["id"]}, {"_id": 0})
-    if not case:
-        raise HTTPException(status_code=404, detail="Case not found")
+def build_case_etag(version: Optional[int]) -> str:
+    # status_calc das parcelas depende da data atual, então o dia entra no ETag.
+    return f'"{version or 0}-{date.today().isoformat()}"'
 
-    agreement = await db.agreements.find_one({"case_id": case_id}, {"_id": 0})
-    installments = []
+
+CASE_DETAIL_LOOKUP_STAGES: list[dict[str, Any]] = [
+    {"$project": CASE_PUBLIC_PROJECTION},
+    {
+        "$lookup": {
+            "from": "agreements",
+            "localField": "id",
+            "foreignField": "case_id",
+            "as": "agreement",
+        }
+    },
+    {"$set": {"agreement": {"$slice": ["$agreement", 1]}}},
+    {
+        "$lookup": {
+            "from": "installments",
+            "localField": "agreement.id",
+            "foreignField": "agreement_id",
+            "as": "installments",
+        }
+    },
+    {
+        "$lookup": {
+            "from": "alvaras",
+            "localField": "id",
+            "foreignField": "case_id",
+            "as": "alvaras",
+        }
+    },
+    {"$project": {"agreement._id": 0, "installments._id": 0, "alvaras._id": 0}},
+]
+
+
+def build_case_detail(document: dict[str, Any]) -> dict[str, Any]:
+    agreement = (document.pop("agreement") or [None])[0]
+    installments = document.pop("installments")
+    alvaras = document.pop("alvaras")
 
     if agreement:
-        agreement["observation"] = agreement.get("observation")        
-        installments = await db.installments.find({"agreement_id": agreement["id"]}, {"_id": 0}).to_list(1000)
+        agreement["observation"] = agreement.get("observation")
         for inst in installments:
             inst["status_calc"] = calculate_installment_status(inst["due_date"], inst.get("paid_date"))
-        installments.sort(key=lambda inst: (not inst.get("is_entry", False), inst.get("number") is None, inst.get("number")))            
+            serialize_stored_dates(inst)
+        installments.sort(key=lambda inst: (not inst.get("is_entry", False), inst.get("number") is None, inst.get("number")))
+    else:
+        installments = []
+
+    for alvara in alvaras:
+        serialize_stored_dates(alvara)
+
+    return {
+        "case": document,
+        "agreement": agreement,
+        "installments": installments,
+        "alvaras": alvaras,
+        "total_received": document.get("total_received", 0.0),
+        "percent_recovered": document.get("percent_recovered", 0.0),
+    }
+
+
+@api_router.get("/cases/{case_id}")
+async def get_case(
+    case_id: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user),
+):
+    await flush_case_recomputes([case_id])
+    case_filter = {"id": case_id, "user_id": current_user["id"]}
+
+    if if_none_match:
+        current = await db.cases.find_one(case_filter, {"_id": 0, "version": 1})
+        if not current:
+            raise HTTPException(status_code=404, detail="Case not found")
+        etag = build_case_etag(current.get("version"))
+        if etag in [tag.strip() for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+
+    documents = await db.cases.aggregate([{"$match": case_filter}, *CASE_DETAIL_LOOKUP_STAGES]).to_list(1)
+    if not documents:
+        raise HTTPException(status_code=404, detail="Case not found")
+
+    detail = build_case_detail(documents[0])
+    response.headers["ETag"] = build_case_etag(detail["case"].get("version"))
+    response.headers["Cache-Control"] = "private, no-cache"
+    return detail
+
+
+@api_router.post("/cases/batch")
+async def get_cases_batch(payload: CaseBatchRequest, current_user: dict = Depends(get_current_user)):
+    case_ids = list(dict.fromkeys(payload.case_ids))
+    if len(case_ids) > MAX_CASE_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Máximo de {MAX_CASE_BATCH_SIZE} casos por requisição")
+    if not case_ids:
+        return {"items": [], "not_found": []}
+
+    await flush_case_recomputes(case_ids)
+
+    # Quatro consultas com $in, independente do tamanho do lote.
+    cases = await db.cases.find(
+        {"id": {"$in": case_ids}, "user_id": current_user["id"]}, CASE_PUBLIC_PROJECTION
+    ).to_list(None)
+    found_ids = [case["id"] for case in cases]
+
+    agreements_by_case: dict[str, dict[str, Any]] = {}
+    async for agreement in db.agreements.find({"case_id": {"$in": found_ids}}, {"_id": 0}):
+        agreements_by_case.setdefault(agreement["case_id"], agreement)
+
+    installments_by_agreement: dict[str, list[dict[str, Any]]] = {}
+    agreement_ids = [agreement["id"] for agreement in agreements_by_case.values()]
+    if agreement_ids:
+        async for inst in db.installments.find({"agreement_id": {"$in": agreement_ids}}, {"_id": 0}):
+            installments_by_agreement.setdefault(inst["agreement_id"], []).append(inst)
 
-    alvaras = await db.alvaras.find({"case_id": case_id}, {"_id": 0}).to_list(1000)
+    alvaras_by_case: dict[str, list[dict[str, Any]]] = {}
+    async for alvara in db.alvaras.find({"case_id": {"$in": found_ids}}, {"_id": 0}):
+        alvaras_by_case.setdefault(alvara["case_id"], []).append(alvara)
 
-    total_received = case.get("total_received", 0.0)
-    percent_recovered = case.get("percent_recovered", 0.0)
+    details: dict[str, dict[str, Any]] = {}
+    for case in cases:
+        agreement = agreements_by_case.get(case["id"])
+        details[case["id"]] = build_case_detail(
+            {
+                **case,
+                "agreement": [agreement] if agreement else [],
+                "installments": installments_by_agreement.get(agreement["id"], []) if agreement else [],
+                "alvaras": alvaras_by_case.get(case["id"], []),
+            }
+        )
 
     return {
-        "case": case,
-        "agreement": agreement,
-        "installments": installments,
-        "alvaras": alvaras,
-        "total_received": total_received,
-        "percent_recovered": percent_recovered
+        "items": [details[case_id] for case_id in case_ids if case_id in details],
+        "not_found": [case_id for case_id in case_ids if case_id not in details],
     }
 
 
 @api_router.put("/cases/{case_id}")
-async def update_case(case_id: str, case_data: CaseUpdate, current_user: dict = Depends(get_current_user)):
+async def update_case(
+    case_id: str,
+    case_data: CaseUpdate,
+    sync: bool = False,
+    current_user: dict = Depends(get_current_user),
+):
     case = await db.cases.find_one({"id": case_id, "user_id": current_user["id"]}, {"_id": 0})
     if not case:
         raise HTTPException(status_code=404, detail="Case not found")
@@ -672,12 +1906,16 @@ async def update_case(case_id: str, case_data: CaseUpdate, current_user: dict =
     update_data = {k: v for k, v in case_data.model_dump().items() if v is not None}
     if "polo_ativo_text" in update_data:
         update_data["polo_ativo_codigo"] = extract_beneficiary_code(update_data["polo_ativo_text"])
+    if any(field in update_data for field in CASE_SEARCH_SOURCE_FIELDS):
+        update_data.update(build_case_search_fields({**case, **update_data}))
 
     if update_data:
-        await db.cases.update_one({"id": case_id}, {"$set": update_data})
+        await db.cases.update_one({"id": case_id}, {"$set": update_data, "$inc": {"version": 1}})
 
-    await update_case_materialized_fields(case_id)
-    return await db.cases.find_one({"id": case_id}, {"_id": 0})
+    await refresh_case_fields([case_id], sync)
+    if update_data.get("polo_ativo_codigo", case.get("polo_ativo_codigo")) != case.get("polo_ativo_codigo"):
+        await sync_receipts_ledger([case_id])
+    return await db.cases.find_one({"id": case_id}, CASE_PUBLIC_PROJECTION)
 
 
 @api_router.delete("/cases/{case_id}")
@@ -693,14 +1931,22 @@ async def delete_case(case_id: str, current_user: dict = Depends(get_current_use
 
     await db.alvaras.delete_many({"case_id": case_id})
     await db.cases.delete_one({"id": case_id})
+    invalidate_case_counts(current_user["id"])
+    await sync_receipts_ledger([case_id])
     return {"message": "Case deleted"}
 
 
 @api_router.post("/agreements")
-async def create_agreement(agreement_data: AgreementCreate, current_user: dict = Depends(get_current_user)):
+async def create_agreement(
+    agreement_data: AgreementCreate,
+    sync: bool = False,
+    current_user: dict = Depends(get_current_user),
+):
     case = await db.cases.find_one({"id": agreement_data.case_id, "user_id": current_user["id"]}, {"_id": 0})
     if not case:
         raise HTTPException(status_code=404, detail="Case not found")
+    if agreement_data.installments_count > MAX_INSTALLMENTS_COUNT:
+        raise HTTPException(status_code=400, detail=f"Máximo de {MAX_INSTALLMENTS_COUNT} parcelas por acordo")
 
     agreement = Agreement(
         id=str(uuid.uuid4()),
@@ -708,65 +1954,89 @@ async def create_agreement(agreement_data: AgreementCreate, current_user: dict =
         **agreement_data.model_dump()
     )
 
-    await db.agreements.insert_one(agreement.model_dump())
-
-    # =========================
     # =========================
     # GERAÇÃO DAS PARCELAS
     # =========================
 
-    # 1️⃣ ENTRADA (quando existir e NÃO for via alvará)
-    if agreement.has_entry and not agreement.entry_via_alvara:
-        entry_installment = {
-            "id": str(uuid.uuid4()),
-            "agreement_id": agreement.id,
-            "is_entry": True,
-            "number": None,
-            "due_date": agreement.entry_date,
-            "paid_date": None,              # 👈 NÃO PAGA
-            "paid_value": None,             # 👈 NÃO RECEBIDA
-            "created_at": datetime.now(timezone.utc).isoformat(),
-        }
-        await db.installments.insert_one(entry_installment)
-
-    # 2️⃣ PARCELAS MENSAIS (mês calendário)
-    first_due = datetime.strptime(agreement.first_due_date, "%Y-%m-%d")
-
-    for i in range(agreement.installments_count):
-        due_date = first_due + relativedelta(months=i)
-
-        installment = {
-            "id": str(uuid.uuid4()),
-            "agreement_id": agreement.id,
-            "number": i + 1,
-            "is_entry": False,
-            "due_date": due_date.strftime("%Y-%m-%d"),
-            "paid_date": None,
-            "paid_value": None,
-            "created_at": datetime.now(timezone.utc).isoformat(),
-        }
-        await db.installments.insert_one(installment)
+    # Entrada como parcela quando existir e NÃO for via alvará; o cronograma é montado em memória.
+    installments = build_installment_schedule(
+        agreement.id,
+        agreement.case_id,
+        current_user["id"],
+        agreement.first_due_date,
+        agreement.installments_count,
+        has_entry=bool(agreement.has_entry and not agreement.entry_via_alvara),
+        entry_date=agreement.entry_date,
+    )
 
-    # 3️⃣ ENTRADA VIA ALVARÁ (quando aplicável)
+    # Entrada via alvará (quando aplicável)
+    alvara_entry = None
     if agreement.has_entry and agreement.entry_via_alvara:
         alvara_entry = {
             "id": str(uuid.uuid4()),
             "case_id": agreement.case_id,
-            "data_alvara": agreement.entry_date or datetime.now().strftime("%Y-%m-%d"),
+            "user_id": current_user["id"],
+            "data_alvara": to_db_date(agreement.entry_date or date.today()),
             "valor_alvara": agreement.entry_value or 0.0,
             "beneficiario_codigo": case.get("polo_ativo_codigo"),
             "status_alvara": "Aguardando alvará",
             "observacoes": "Entrada via alvará",
-            "created_at": datetime.now(timezone.utc).isoformat(),
+            "created_at": datetime.now(timezone.utc),
         }
-        await db.alvaras.insert_one(alvara_entry)
 
-    await update_case_materialized_fields(agreement.case_id)
+    async def write_agreement(session: Any) -> None:
+        await db.agreements.insert_one(agreement.model_dump(), session=session)
+        await insert_installments(installments, session=session)
+        if alvara_entry:
+            await db.alvaras.insert_one(alvara_entry, session=session)
+
+    await run_in_transaction(write_agreement)
+
+    await refresh_case_fields([agreement.case_id], sync)
     return agreement
 
 
+@api_router.post("/agreements/preview")
+async def preview_agreement(payload: AgreementPreview, current_user: dict = Depends(get_current_user)):
+    try:
+        first_due = datetime.strptime(payload.first_due_date, "%Y-%m-%d").date()
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail="Data da 1ª parcela inválida.") from exc
+    if payload.installments_count <= 0:
+        raise HTTPException(status_code=400, detail="Número de parcelas inválido.")
+    if payload.installments_count > MAX_INSTALLMENTS_COUNT:
+        raise HTTPException(status_code=400, detail=f"Máximo de {MAX_INSTALLMENTS_COUNT} parcelas por acordo")
+
+    schedule: list[dict[str, Any]] = []
+    total = 0.0
+    if payload.has_entry:
+        entry_due = safe_parse_date(payload.entry_date)
+        if payload.entry_date and entry_due is None:
+            raise HTTPException(status_code=400, detail="Data da entrada inválida.")
+        entry_value = payload.entry_value or 0.0
+        schedule.append(
+            {
+                "number": None,
+                "is_entry": True,
+                "via_alvara": bool(payload.entry_via_alvara),
+                "due_date": entry_due.isoformat() if entry_due else None,
+                "value": entry_value,
+            }
+        )
+        total += entry_value
+
+    due_dates = compute_monthly_due_dates(first_due, payload.installments_count)
+    for number, due_date in enumerate(due_dates.astype(str).tolist(), start=1):
+        schedule.append(
+            {"number": number, "is_entry": False, "due_date": due_date, "value": payload.installment_value}
+        )
+    total += payload.installment_value * payload.installments_count
+
+    return {"installments": schedule, "total": round(total, 2)}
+
+
 @api_router.delete("/agreements/{agreement_id}")
-async def delete_agreement(agreement_id: str, current_user: dict = Depends(get_current_user)):
+async def delete_agreement(agreement_id: str, sync: bool = False, current_user: dict = Depends(get_current_user)):
     agreement = await db.agreements.find_one({"id": agreement_id}, {"_id": 0})
     if not agreement:
         raise HTTPException(status_code=404, detail="Agreement not found")
@@ -778,13 +2048,15 @@ async def delete_agreement(agreement_id: str, current_user: dict = Depends(get_c
     await db.installments.delete_many({"agreement_id": agreement_id})
     await db.agreements.delete_one({"id": agreement_id})
 
-    await update_case_materialized_fields(agreement["case_id"])
+    await refresh_case_fields([agreement["case_id"]], sync)
+    await sync_receipts_ledger([agreement["case_id"]])
     return {"message": "Agreement deleted"}
 
 @api_router.put("/agreements/{agreement_id}")
 async def update_agreement(
     agreement_id: str,
     payload: AgreementUpdate,
+    sync: bool = False,
     current_user: dict = Depends(get_current_user)
 ):
     agreement = await db.agreements.find_one({"id": agreement_id}, {"_id": 0})
@@ -804,12 +2076,13 @@ async def update_agreement(
 
     # Atualiza o acordo
     await db.agreements.update_one({"id": agreement_id}, {"$set": update_data})
+    await bump_case_versions([agreement["case_id"]])
 
     effective_data = {**agreement, **update_data}
 
     installments = await db.installments.find(
         {"agreement_id": agreement_id}, {"_id": 0}
-    ).to_list(1000)
+    ).to_list(None)
 
     has_paid_installments = any(inst.get("paid_date") for inst in installments)
 
@@ -836,25 +2109,22 @@ async def update_agreement(
                 status_code=400,
                 detail="Número de parcelas inválido.",
             )
-
-        # Remove apenas parcelas não pagas
-        await db.installments.delete_many(
-            {"agreement_id": agreement_id, "paid_date": None}
+        if effective_data["installments_count"] > MAX_INSTALLMENTS_COUNT:
+            raise HTTPException(status_code=400, detail=f"Máximo de {MAX_INSTALLMENTS_COUNT} parcelas por acordo")
+
+        schedule = build_installment_schedule(
+            agreement_id,
+            agreement["case_id"],
+            current_user["id"],
+            first_due.strftime("%Y-%m-%d"),
+            effective_data["installments_count"],
         )
 
-        for i in range(effective_data["installments_count"]):
-            due_date = first_due + relativedelta(months=i)
-            installment = {
-                "id": str(uuid.uuid4()),
-                "agreement_id": agreement_id,
-                "number": i + 1,
-                "is_entry": False,
-                "due_date": due_date.strftime("%Y-%m-%d"),
-                "paid_date": None,
-                "paid_value": None,
-                "created_at": datetime.now(timezone.utc).isoformat(),
-            }
-            await db.installments.insert_one(installment)
+        operations = diff_installment_schedule(
+            installments, schedule, drop_unpaid_entries=not effective_data.get("has_entry")
+        )
+        if operations:
+            await db.installments.bulk_write(operations)
 
         if effective_data.get("has_entry"):
             if effective_data.get("entry_via_alvara"):
@@ -870,7 +2140,7 @@ async def update_agreement(
                     if entry_alvara.get("status_alvara") != "Alvará pago":
                         alvara_update = {}
                         if effective_data.get("entry_date"):
-                            alvara_update["data_alvara"] = effective_data["entry_date"]
+                            alvara_update["data_alvara"] = to_db_date(effective_data["entry_date"])
                         if effective_data.get("entry_value") is not None:
                             alvara_update["valor_alvara"] = effective_data["entry_value"]
                         if alvara_update:
@@ -879,13 +2149,13 @@ async def update_agreement(
                     alvara_entry = {
                         "id": str(uuid.uuid4()),
                         "case_id": agreement["case_id"],
-                        "data_alvara": effective_data.get("entry_date")
-                        or datetime.now().strftime("%Y-%m-%d"),
+                        "user_id": current_user["id"],
+                        "data_alvara": to_db_date(effective_data.get("entry_date") or date.today()),
                         "valor_alvara": effective_data.get("entry_value") or 0.0,
                         "beneficiario_codigo": case.get("polo_ativo_codigo"),
                         "status_alvara": "Aguardando alvará",
                         "observacoes": "Entrada via alvará",
-                        "created_at": datetime.now(timezone.utc).isoformat(),
+                        "created_at": datetime.now(timezone.utc),
                     }
                     await db.alvaras.insert_one(alvara_entry)
             else:
@@ -903,19 +2173,12 @@ async def update_agreement(
                     if entry_installment.get("paid_date") is None:
                         await db.installments.update_one(
                             {"id": entry_installment["id"]},
-                            {"$set": {"due_date": entry_date}},
+                            {"$set": {"due_date": to_db_date(entry_date)}},
                         )
                 else:
-                    entry_installment = {
-                        "id": str(uuid.uuid4()),
-                        "agreement_id": agreement_id,
-                        "is_entry": True,
-                        "number": None,
-                        "due_date": entry_date,
-                        "paid_date": None,
-                        "paid_value": None,
-                        "created_at": datetime.now(timezone.utc).isoformat(),
-                    }
+                    entry_installment = build_installment_record(
+                        agreement_id, agreement["case_id"], current_user["id"], None, entry_date, is_entry=True
+                    )
                     await db.installments.insert_one(entry_installment)
         elif update_data.get("has_entry") is False:
             # Decisão sensível: limpamos registros de entrada ainda não pagos quando removidos pelo usuário.
@@ -930,13 +2193,18 @@ async def update_agreement(
                 }
             )
 
-        await update_case_materialized_fields(agreement["case_id"])
+        await refresh_case_fields([agreement["case_id"]], sync)
 
     return {"message": "Agreement updated successfully"}
 
 
 @api_router.put("/installments/{installment_id}")
-async def update_installment(installment_id: str, update_data: InstallmentUpdate, current_user: dict = Depends(get_current_user)):
+async def update_installment(
+    installment_id: str,
+    update_data: InstallmentUpdate,
+    sync: bool = False,
+    current_user: dict = Depends(get_current_user),
+):
     installment = await db.installments.find_one({"id": installment_id}, {"_id": 0})
     if not installment:
         raise HTTPException(status_code=404, detail="Installment not found")
@@ -950,6 +2218,8 @@ async def update_installment(installment_id: str, update_data: InstallmentUpdate
         raise HTTPException(status_code=404, detail="Case not found")
 
     update_payload = {k: v for k, v in update_data.model_dump().items() if v is not None}
+    if "paid_date" in update_payload:
+        update_payload["paid_date"] = to_db_date(update_payload["paid_date"])
     if update_payload:
         await db.installments.update_one({"id": installment_id}, {"$set": update_payload})
 
@@ -959,16 +2229,128 @@ async def update_installment(installment_id: str, update_data: InstallmentUpdate
         updated_installment.get("paid_date")
     )
 
-    await update_case_materialized_fields(agreement["case_id"])
-    return updated_installment
+    await refresh_case_fields([agreement["case_id"]], sync)
+    await sync_receipts_ledger([agreement["case_id"]])
+    return serialize_stored_dates(updated_installment)
+
+
+async def resolve_owned_installments(installment_ids: list[str], user_id: str) -> dict[str, str]:
+    installments = await db.installments.find(
+        {"id": {"$in": installment_ids}},
+        {"_id": 0, "id": 1, "agreement_id": 1},
+    ).to_list(None)
+    agreement_ids = list({inst["agreement_id"] for inst in installments})
+    agreement_cases = {
+        agreement["id"]: agreement["case_id"]
+        async for agreement in db.agreements.find(
+            {"id": {"$in": agreement_ids}}, {"_id": 0, "id": 1, "case_id": 1}
+        )
+    }
+    owned_cases = set(
+        await db.cases.distinct("id", {"id": {"$in": list(set(agreement_cases.values()))}, "user_id": user_id})
+    )
+    # installment_id -> case_id apenas para parcelas do usuário
+    return {
+        inst["id"]: agreement_cases[inst["agreement_id"]]
+        for inst in installments
+        if agreement_cases.get(inst["agreement_id"]) in owned_cases
+    }
+
+
+async def apply_installment_payments(
+    items: list[InstallmentPayment],
+    user_id: str,
+    sync: bool = False,
+) -> dict[str, Any]:
+    if not items:
+        raise HTTPException(status_code=400, detail="Nenhuma parcela informada")
+    if len(items) > MAX_BULK_PAY_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Máximo de {MAX_BULK_PAY_ITEMS} parcelas por lote")
+
+    payments: dict[str, dict[str, Any]] = {}
+    for item in items:
+        paid_date = safe_parse_date(item.paid_date)
+        if paid_date is None:
+            raise HTTPException(status_code=400, detail=f"Data de pagamento inválida: {item.installment_id}")
+        payments[item.installment_id] = {"paid_date": to_db_date(paid_date), "paid_value": item.paid_value}
+
+    case_by_installment = await resolve_owned_installments(list(payments), user_id)
+    not_found = [installment_id for installment_id in payments if installment_id not in case_by_installment]
+
+    operations = [
+        UpdateOne({"id": installment_id}, {"$set": payments[installment_id]})
+        for installment_id in case_by_installment
+    ]
+    if operations:
+        await db.installments.bulk_write(operations, ordered=False)
+
+    case_ids = list(set(case_by_installment.values()))
+    if case_ids:
+        await refresh_case_fields(case_ids, sync)
+        await sync_receipts_ledger(case_ids)
+
+    return {"updated": len(operations), "cases": len(case_ids), "not_found": not_found}
+
+
+@api_router.post("/installments/bulk-pay")
+async def bulk_pay_installments(
+    payload: InstallmentBulkPay,
+    sync: bool = False,
+    current_user: dict = Depends(get_current_user),
+):
+    return await apply_installment_payments(payload.items, current_user["id"], sync)
 
 @api_router.get("/alvaras")
-async def list_alvaras(case_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
-    query = {}
+async def list_alvaras(
+    case_id: Optional[str] = None,
+    status_alvara: Optional[str] = None,
+    beneficiario: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = 100,
+    current_user: dict = Depends(get_current_user),
+):
+    safe_limit = min(max(limit, 1), 500)
+    query: dict[str, Any] = {"user_id": current_user["id"]}
     if case_id:
         query["case_id"] = case_id
-    alvaras = await db.alvaras.find(query, {"_id": 0}).to_list(1000)
-    return alvaras
+    if status_alvara:
+        query["status_alvara"] = status_alvara
+    if beneficiario:
+        query["beneficiario_codigo"] = beneficiario
+
+    date_range: dict[str, Any] = {}
+    for operator, raw_value in (("$gte", start_date), ("$lte", end_date)):
+        if raw_value:
+            parsed = to_db_date(safe_parse_date(raw_value))
+            if parsed is None:
+                raise HTTPException(status_code=400, detail="Data inválida")
+            date_range[operator] = parsed
+    if date_range:
+        query["data_alvara"] = date_range
+
+    if after:
+        after_date, after_id = decode_cursor(after, 2)
+        after_value = to_db_date(after_date) if after_date is not None else None
+        if after_date is not None and after_value is None:
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+        query = {"$and": [query, build_keyset_filter("data_alvara", -1, after_value, after_id)]}
+
+    alvaras = await db.alvaras.find(query, {"_id": 0}).sort(
+        [("data_alvara", -1), ("id", -1)]
+    ).limit(safe_limit + 1).to_list(safe_limit + 1)
+
+    next_cursor = None
+    if len(alvaras) > safe_limit:
+        alvaras = alvaras[:safe_limit]
+        last = serialize_stored_dates(dict(alvaras[-1]))
+        next_cursor = encode_cursor([last.get("data_alvara"), last["id"]])
+
+    return {
+        "alvaras": [serialize_stored_dates(alvara) for alvara in alvaras],
+        "next_cursor": next_cursor,
+    }
 
 
 @api_router.get("/alvaras/pendentes")
@@ -996,7 +2378,7 @@ async def list_alvaras_pendentes(current_user: dict = Depends(get_current_user))
             {
                 "alvara_id": alvara.get("id"),
                 "case_id": alvara.get("case_id"),
-                "data": alvara.get("data_alvara"),
+                "data": serialize_stored_dates(alvara).get("data_alvara"),
                 "devedor": case.get("debtor_name", ""),
                 "numero_processo": case.get("numero_processo", ""),
                 "valor": alvara.get("valor_alvara", 0.0),
@@ -1010,6 +2392,7 @@ async def list_alvaras_pendentes(current_user: dict = Depends(get_current_user))
 @api_router.post("/alvaras")
 async def create_alvara(
     alvara_data: AlvaraCreate,
+    sync: bool = False,
     current_user: dict = Depends(get_current_user)
 ):
     case = None
@@ -1025,6 +2408,7 @@ async def create_alvara(
     alvara = {
         "id": str(uuid.uuid4()),
         **alvara_data.model_dump(),
+        "data_alvara": to_db_date(alvara_data.data_alvara),
         "user_id": current_user["id"],
         "created_at": datetime.now(timezone.utc),
         "updated_at": datetime.now(timezone.utc),
@@ -1035,7 +2419,8 @@ async def create_alvara(
 
     if alvara_data.case_id:
         try:
-            await update_case_materialized_fields(alvara_data.case_id)
+            await refresh_case_fields([alvara_data.case_id], sync)
+            await sync_receipts_ledger([alvara_data.case_id])
         except Exception:
             pass  # evita erro 500 por falha secundária
 
@@ -1046,7 +2431,12 @@ async def create_alvara(
 
 
 @api_router.put("/alvaras/{alvara_id}")
-async def update_alvara(alvara_id: str, alvara_data: AlvaraUpdate, current_user: dict = Depends(get_current_user)):
+async def update_alvara(
+    alvara_id: str,
+    alvara_data: AlvaraUpdate,
+    sync: bool = False,
+    current_user: dict = Depends(get_current_user),
+):
     alvara = await db.alvaras.find_one({"id": alvara_id}, {"_id": 0})
     if not alvara:
         raise HTTPException(status_code=404, detail="Alvará not found")
@@ -1056,15 +2446,18 @@ async def update_alvara(alvara_id: str, alvara_data: AlvaraUpdate, current_user:
         raise HTTPException(status_code=404, detail="Case not found")
 
     update_payload = {k: v for k, v in alvara_data.model_dump().items() if v is not None}
+    if "data_alvara" in update_payload:
+        update_payload["data_alvara"] = to_db_date(update_payload["data_alvara"])
     if update_payload:
         await db.alvaras.update_one({"id": alvara_id}, {"$set": update_payload})
 
-    await update_case_materialized_fields(alvara["case_id"])
-    return await db.alvaras.find_one({"id": alvara_id}, {"_id": 0})
+    await refresh_case_fields([alvara["case_id"]], sync)
+    await sync_receipts_ledger([alvara["case_id"]])
+    return serialize_stored_dates(await db.alvaras.find_one({"id": alvara_id}, {"_id": 0}))
 
 
 @api_router.delete("/alvaras/{alvara_id}")
-async def delete_alvara(alvara_id: str, current_user: dict = Depends(get_current_user)):
+async def delete_alvara(alvara_id: str, sync: bool = False, current_user: dict = Depends(get_current_user)):
     alvara = await db.alvaras.find_one({"id": alvara_id}, {"_id": 0})
     if not alvara:
         raise HTTPException(status_code=404, detail="Alvará not found")
@@ -1074,18 +2467,15 @@ async def delete_alvara(alvara_id: str, current_user: dict = Depends(get_current
         raise HTTPException(status_code=404, detail="Case not found")
 
     await db.alvaras.delete_one({"id": alvara_id})
-    await update_case_materialized_fields(alvara["case_id"])
+    await refresh_case_fields([alvara["case_id"]], sync)
+    await sync_receipts_ledger([alvara["case_id"]])
     return {"message": "Alvará deleted"}
 
-@api_router.get("/receipts")
-async def get_receipts_optimized(
-    start_date: Optional[str] = None,
-    end_date: Optional[str] = None,
-    beneficiario: Optional[str] = None,
-    type: Optional[str] = None,
-    preset: Optional[str] = None,
-    current_user: dict = Depends(get_current_user),
-):
+def resolve_receipts_period(
+    preset: Optional[str],
+    start_date: Optional[str],
+    end_date: Optional[str],
+) -> tuple[Optional[date], Optional[date]]:
     today = datetime.now(timezone.utc).date()
 
     if preset == "day":
@@ -1107,129 +2497,339 @@ async def get_receipts_optimized(
     if not end_date:
         end_date = "9999-12-31"
 
-    start = safe_parse_date(start_date)
-    end = safe_parse_date(end_date)
-    
-    receipts = []
-    totals = {
+    return safe_parse_date(start_date), safe_parse_date(end_date)
+
+
+def empty_receipts_kpis() -> dict[str, Any]:
+    return {
         "total_received": 0.0,
         "total_31": 0.0,
         "total_14": 0.0,
         "total_parcelas": 0.0,
         "total_alvaras": 0.0,
+        "cases_with_receipts": 0,
     }
-    case_ids = set()
-    if not start or not end:
-        return {
-            "receipts": receipts,
-            "kpis": {**totals, "cases_with_receipts": len(case_ids)},
-            "monthly_consolidation": [],
-        }    
 
-    cases = await db.cases.find(
-        {"user_id": current_user["id"]},
-        {"_id": 0, "id": 1, "debtor_name": 1, "numero_processo": 1, "polo_ativo_codigo": 1},
-    ).to_list(None)
-    case_map = {c["id"]: c for c in cases}
 
-    # Parcelas pagas
-    if type in (None, "all", "parcelas", "entrada"):
-        installments = await db.installments.find(
-            {"paid_date": {"$ne": None}}, {"_id": 0}
-        ).to_list(None)
+RECEIPT_TYPE_FILTERS: dict[Optional[str], Optional[str]] = {
+    None: None,
+    "all": None,
+    "parcelas": "Parcela",
+    "entrada": "Entrada",
+    "alvara": "Alvará Judicial",
+}
 
-        for inst in installments:
-            paid_date = safe_parse_date(inst.get("paid_date"))
-            if not paid_date or not start or not end:
-                continue
-            if not (start <= paid_date <= end):
-                continue
 
-            is_entry = bool(inst.get("is_entry"))
-            if type == "entrada" and not is_entry:
-                continue
-            if type == "parcelas" and is_entry:
-                continue
-            
-            agreement = await db.agreements.find_one(
-                {"id": inst["agreement_id"]}, {"_id": 0, "case_id": 1}
-            )
-            if not agreement or agreement["case_id"] not in case_map:
-                continue
+def build_receipts_query(
+    user_id: str,
+    start: date,
+    end: date,
+    beneficiario: Optional[str],
+    receipt_type: Optional[str],
+) -> Optional[dict[str, Any]]:
+    if receipt_type not in RECEIPT_TYPE_FILTERS:
+        return None
+
+    query: dict[str, Any] = {
+        "user_id": user_id,
+        "date": {"$gte": to_db_date(start), "$lte": to_db_date(end)},
+        "reversed_at": None,
+    }
+    if beneficiario not in (None, "all"):
+        query["beneficiario"] = beneficiario
+    if RECEIPT_TYPE_FILTERS[receipt_type]:
+        query["type"] = RECEIPT_TYPE_FILTERS[receipt_type]
+    return query
+
+
+def sum_receipts_when(condition: dict[str, Any]) -> dict[str, Any]:
+    return {"$sum": {"$cond": [condition, "$value", 0]}}
+
+
+RECEIPT_ROW_STAGES: list[dict[str, Any]] = [
+    {"$lookup": {"from": "cases", "localField": "case_id", "foreignField": "id", "as": "case"}},
+    {"$unwind": "$case"},
+    {
+        "$project": {
+            "_id": 0,
+            "id": 1,
+            "date": {"$dateToString": {"format": "%Y-%m-%d", "date": "$date"}},
+            "case_id": 1,
+            "debtor": "$case.debtor_name",
+            "numero_processo": {"$ifNull": ["$case.numero_processo", ""]},
+            "type": 1,
+            "value": 1,
+            "beneficiario": 1,
+            "observacoes": 1,
+        }
+    },
+]
+
+RECEIPT_KPI_STAGES: list[dict[str, Any]] = [
+    {
+        "$group": {
+            "_id": None,
+            "total_received": {"$sum": "$value"},
+            "total_31": sum_receipts_when({"$eq": ["$beneficiario", "31"]}),
+            "total_14": sum_receipts_when({"$eq": ["$beneficiario", "14"]}),
+            "total_parcelas": sum_receipts_when({"$ne": ["$source_type", "alvara"]}),
+            "total_alvaras": sum_receipts_when({"$eq": ["$source_type", "alvara"]}),
+            "case_ids": {"$addToSet": "$case_id"},
+        }
+    },
+    {"$addFields": {"cases_with_receipts": {"$size": "$case_ids"}}},
+    {"$project": {"_id": 0, "case_ids": 0}},
+]
+
+RECEIPT_MONTHLY_STAGES: list[dict[str, Any]] = [
+    {
+        "$group": {
+            "_id": {"$dateToString": {"format": "%Y-%m", "date": "$date"}},
+            "total_31": sum_receipts_when({"$eq": ["$beneficiario", "31"]}),
+            "total_14": sum_receipts_when({"$eq": ["$beneficiario", "14"]}),
+            "total_parcelas": sum_receipts_when({"$ne": ["$source_type", "alvara"]}),
+            "total_alvaras": sum_receipts_when({"$eq": ["$source_type", "alvara"]}),
+            "total": {"$sum": "$value"},
+        }
+    },
+    {"$sort": {"_id": 1}},
+    {"$addFields": {"month": "$_id"}},
+    {"$project": {"_id": 0}},
+]
 
-            case = case_map[agreement["case_id"]]
-            beneficiario_codigo = case.get("polo_ativo_codigo")
 
-            if beneficiario not in (None, "all", beneficiario_codigo):
-                continue
+def build_receipts_pipeline(query: dict[str, Any]) -> list[dict[str, Any]]:
+    # Linhas ficam fora do $facet: o documento de saída do $facet é limitado a 16 MB.
+    facets = {"kpis": RECEIPT_KPI_STAGES, "monthly_consolidation": RECEIPT_MONTHLY_STAGES}
+    return [{"$match": query}, {"$facet": facets}]
 
-            value = inst.get("paid_value", 0.0)
-            label = "Entrada" if inst.get("is_entry") else "Parcela"
 
-            receipts.append({
-                "date": paid_date.strftime("%Y-%m-%d"),
-                "case_id": case["id"],
-                "debtor": case["debtor_name"],
-                "numero_processo": case.get("numero_processo", ""),
-                "type": label,
-                "value": value,
-                "beneficiario": beneficiario_codigo,
-                "observacoes": f"{label} #{inst.get('number', '')}",
-            })
-
-            totals["total_received"] += value
-            totals["total_parcelas"] += value
-            totals[f"total_{beneficiario_codigo}"] += value if beneficiario_codigo in ("31", "14") else 0
-            case_ids.add(case["id"])
-
-    # Alvarás pagos
-    if type in (None, "all", "alvara"):
-        alvaras = await db.alvaras.find(
-            {"status_alvara": "Alvará pago"}, {"_id": 0}
-        ).to_list(None)
+def build_receipt_rows_pipeline(query: dict[str, Any]) -> list[dict[str, Any]]:
+    return [{"$match": query}, {"$sort": {"date": -1, "id": -1}}, *RECEIPT_ROW_STAGES]
 
-        for alv in alvaras:
-            alvara_date = safe_parse_date(alv.get("data_alvara"))
-            if not alvara_date or not start or not end:
-                continue
-            if not (start <= alvara_date <= end):
-                continue
 
-            case = case_map.get(alv["case_id"])
-            if not case:
-                continue
+def encode_cursor(values: list[Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
 
-            beneficiario_codigo = alv.get("beneficiario_codigo")
-            if beneficiario not in (None, "all", beneficiario_codigo):
-                continue
 
-            value = alv.get("valor_alvara", 0.0)
+def decode_cursor(token: str, size: int) -> list[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except (ValueError, TypeError) as exc:
+        raise HTTPException(status_code=400, detail="Cursor inválido") from exc
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    return values
+
 
-            receipts.append({
-                "date": alvara_date.strftime("%Y-%m-%d"),
-                "case_id": case["id"],
-                "debtor": case["debtor_name"],
-                "numero_processo": case.get("numero_processo", ""),
-                "type": "Alvará Judicial",
-                "value": value,
-                "beneficiario": beneficiario_codigo,
-                "observacoes": alv.get("observacoes", ""),
-            })
+def is_whole_month_period(start: date, end: date) -> bool:
+    return start.day == 1 and (end == date.max or (end + timedelta(days=1)).day == 1)
+
+
+async def load_monthly_consolidation(query: dict[str, Any], start: date, end: date) -> list[dict[str, Any]]:
+    rollup_query: dict[str, Any] = {
+        "user_id": query["user_id"],
+        "month": {"$gte": ledger_month(start.isoformat()), "$lte": ledger_month(end.isoformat())},
+    }
+    if "beneficiario" in query:
+        rollup_query["beneficiario"] = query["beneficiario"]
+    if "type" in query:
+        rollup_query["type"] = query["type"]
+
+    months: dict[str, dict[str, Any]] = {}
+    async for row in db.receipts_monthly.find(rollup_query, {"_id": 0}):
+        if not row.get("count"):
+            continue
+        month = months.setdefault(
+            row["month"],
+            {
+                "month": row["month"],
+                "total_31": 0.0,
+                "total_14": 0.0,
+                "total_parcelas": 0.0,
+                "total_alvaras": 0.0,
+                "total": 0.0,
+            },
+        )
+        total = row.get("total", 0.0)
+        if row.get("beneficiario") in ("31", "14"):
+            month[f"total_{row['beneficiario']}"] += total
+        if row["type"] == "Alvará Judicial":
+            month["total_alvaras"] += total
+        else:
+            month["total_parcelas"] += total
+        month["total"] += total
+
+    return [
+        {key: round(value, 2) if isinstance(value, float) else value for key, value in month.items()}
+        for _, month in sorted(months.items())
+    ]
+
+
+async def load_rollup_kpis(query: dict[str, Any], monthly_consolidation: list[dict[str, Any]]) -> dict[str, Any]:
+    kpis = empty_receipts_kpis()
+    if not monthly_consolidation:
+        return kpis
+    for month in monthly_consolidation:
+        kpis["total_received"] += month["total"]
+        for field in ("total_31", "total_14", "total_parcelas", "total_alvaras"):
+            kpis[field] += month[field]
+    kpis = {key: round(value, 2) if isinstance(value, float) else value for key, value in kpis.items()}
+
+    # O consolidado não guarda casos: só a contagem de casos distintos ainda lê o ledger.
+    counted = await db.receipts_ledger.aggregate(
+        [{"$match": query}, {"$group": {"_id": "$case_id"}}, {"$count": "cases"}]
+    ).to_list(1)
+    kpis["cases_with_receipts"] = counted[0]["cases"] if counted else 0
+    return kpis
+
+
+def resolve_receipts_query(
+    user_id: str,
+    start_date: Optional[str],
+    end_date: Optional[str],
+    beneficiario: Optional[str],
+    receipt_type: Optional[str],
+    preset: Optional[str],
+) -> tuple[Optional[dict[str, Any]], Optional[date], Optional[date]]:
+    start, end = resolve_receipts_period(preset, start_date, end_date)
+    if not start or not end:
+        return None, start, end
+    return build_receipts_query(user_id, start, end, beneficiario, receipt_type), start, end
+
+
+async def load_receipts_summary(
+    query: dict[str, Any],
+    start: date,
+    end: date,
+    include_rows: bool,
+) -> dict[str, Any]:
+    # Períodos de meses fechados (ano, mês, todo o histórico) leem o consolidado pré-calculado.
+    if is_whole_month_period(start, end):
+        monthly_consolidation = await load_monthly_consolidation(query, start, end)
+        kpis = await load_rollup_kpis(query, monthly_consolidation)
+    else:
+        facets = await db.receipts_ledger.aggregate(build_receipts_pipeline(query)).to_list(1)
+        facet = facets[0] if facets else {}
+        kpis = facet["kpis"][0] if facet.get("kpis") else empty_receipts_kpis()
+        monthly_consolidation = facet.get("monthly_consolidation", [])
+
+    summary = {"kpis": kpis, "monthly_consolidation": monthly_consolidation}
+    if include_rows:
+        summary["receipts"] = await db.receipts_ledger.aggregate(build_receipt_rows_pipeline(query)).to_list(None)
+    return summary
 
-            totals["total_received"] += value
-            totals["total_alvaras"] += value
-            totals[f"total_{beneficiario_codigo}"] += value if beneficiario_codigo in ("31", "14") else 0
-            case_ids.add(case["id"])
 
-    receipts.sort(key=lambda r: r["date"], reverse=True)
+@api_router.get("/receipts")
+async def get_receipts_optimized(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    beneficiario: Optional[str] = None,
+    type: Optional[str] = None,
+    preset: Optional[str] = None,
+    current_user: dict = Depends(get_current_user),
+):
+    query, start, end = resolve_receipts_query(
+        current_user["id"], start_date, end_date, beneficiario, type, preset
+    )
+    if not query:
+        return {"receipts": [], "kpis": empty_receipts_kpis(), "monthly_consolidation": []}
 
+    summary = await load_receipts_summary(query, start, end, include_rows=True)
     return {
-        "receipts": receipts,
-        "kpis": {**totals, "cases_with_receipts": len(case_ids)},
-        "monthly_consolidation": [],
+        "receipts": summary["receipts"],
+        "kpis": summary["kpis"],
+        "monthly_consolidation": summary["monthly_consolidation"],
     }
 
 
+@api_router.get("/receipts/kpis")
+async def get_receipts_kpis(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    beneficiario: Optional[str] = None,
+    type: Optional[str] = None,
+    preset: Optional[str] = None,
+    current_user: dict = Depends(get_current_user),
+):
+    query, start, end = resolve_receipts_query(
+        current_user["id"], start_date, end_date, beneficiario, type, preset
+    )
+    if not query:
+        return {"kpis": empty_receipts_kpis(), "monthly_consolidation": []}
+    return await load_receipts_summary(query, start, end, include_rows=False)
+
+
+@api_router.get("/receipts/stream")
+async def stream_receipts(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    beneficiario: Optional[str] = None,
+    type: Optional[str] = None,
+    preset: Optional[str] = None,
+    current_user: dict = Depends(get_current_user),
+):
+    query, _, _ = resolve_receipts_query(
+        current_user["id"], start_date, end_date, beneficiario, type, preset
+    )
+
+    async def generate_rows():
+        if not query:
+            return
+        pipeline = build_receipt_rows_pipeline(query)
+        async for row in db.receipts_ledger.aggregate(pipeline, batchSize=500):
+            yield json.dumps(row, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(generate_rows(), media_type="application/x-ndjson")
+
+
+@api_router.get("/receipts/page")
+async def get_receipts_page(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    beneficiario: Optional[str] = None,
+    type: Optional[str] = None,
+    preset: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = 100,
+    current_user: dict = Depends(get_current_user),
+):
+    safe_limit = min(max(limit, 1), 1000)
+    query, _, _ = resolve_receipts_query(
+        current_user["id"], start_date, end_date, beneficiario, type, preset
+    )
+    if not query:
+        return {"receipts": [], "next_cursor": None}
+
+    if after:
+        after_date, after_id = decode_cursor(after, 2)
+        after_date = to_db_date(after_date)
+        if not after_date:
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+        query = {
+            **query,
+            "$or": [
+                {"date": {"$lt": after_date}},
+                {"date": after_date, "id": {"$lt": after_id}},
+            ],
+        }
+
+    pipeline = [
+        {"$match": query},
+        {"$sort": {"date": -1, "id": -1}},
+        {"$limit": safe_limit + 1},
+        *RECEIPT_ROW_STAGES,
+    ]
+    rows = await db.receipts_ledger.aggregate(pipeline).to_list(safe_limit + 1)
+
+    next_cursor = None
+    if len(rows) > safe_limit:
+        rows = rows[:safe_limit]
+        next_cursor = encode_cursor([rows[-1]["date"], rows[-1]["id"]])
+
+    return {"receipts": rows, "next_cursor": next_cursor}
+
+
 @api_router.get("/receipts/pdf")
 async def get_receipts_pdf_optimized(
     start_date: Optional[str] = None,
@@ -1259,14 +2859,15 @@ async def get_receipts_pdf_optimized(
     )
 
 
-@import_router.post("/upload")
-async def upload_import_file(
-    file: UploadFile = File(...),
-    current_user: dict = Depends(get_current_user)
-):
+async def store_import_upload(
+    file: UploadFile,
+    user_id: str,
+    allowed_extensions: set[str],
+    kind: str = "import",
+) -> str:
     filename = file.filename or ""
     extension = Path(filename).suffix.lower()
-    if extension not in IMPORT_ALLOWED_EXTENSIONS:
+    if extension not in allowed_extensions:
         raise HTTPException(status_code=400, detail="Formato de arquivo não suportado")
 
     contents = await file.read()
@@ -1284,10 +2885,29 @@ async def upload_import_file(
         "path": temp_path,
         "filename": filename,
         "extension": extension,
-        "user_id": current_user["id"],
+        "user_id": user_id,
+        "kind": kind,
         "created_at": datetime.now(timezone.utc).isoformat(),
     }
+    return session_id
+
+
+def discard_import_session(session_id: str) -> None:
+    session = IMPORT_SESSIONS.pop(session_id, None)
+    if not session:
+        return
+    try:
+        os.remove(session["path"])
+    except OSError:
+        pass
+
 
+@import_router.post("/upload")
+async def upload_import_file(
+    file: UploadFile = File(...),
+    current_user: dict = Depends(get_current_user)
+):
+    session_id = await store_import_upload(file, current_user["id"], IMPORT_ALLOWED_EXTENSIONS)
     return {"session_id": session_id}
 
 
@@ -1389,6 +3009,9 @@ async def commit_import_file(
     results: list[dict[str, Any]] = []
     updated_case_ids: set[str] = set()
     total_received_import_values: dict[str, float] = {}    
+    imported_agreement_cases: dict[str, str] = {}
+    imported_installments: list[dict[str, Any]] = []
+    agreements_with_installments: set[str] = set()
 
     for index, row in df.iterrows():
         row_data = build_row_data(row, columns)
@@ -1432,8 +3055,10 @@ async def commit_import_file(
                     "has_agreement": False,
                     "status_acordo": "",
                     "total_received": 0.0,
-                    "percent_recovered": 0.0
+                    "percent_recovered": 0.0,
+                    "version": 1,
                 }
+                case_record.update(build_case_search_fields(case_record))
                 await db.cases.insert_one(case_record)
                 if case_cache_key:
                     case_cache[case_cache_key] = case_record
@@ -1482,17 +3107,19 @@ async def commit_import_file(
 
         has_installment_payload = any(value not in ("", None) for value in installment_payload.values())
         if agreement_record and has_installment_payload:
-            installment_record = {
-                "id": str(uuid.uuid4()),
-                "agreement_id": agreement_record["id"],
-                "is_entry": parse_bool_value(installment_payload.get("is_entry")) or False,
-                "number": parse_int_value(installment_payload.get("number")),
-                "due_date": parse_date_value(installment_payload.get("due_date")) or "",
-                "paid_date": parse_date_value(installment_payload.get("paid_date")),
-                "paid_value": parse_float_value(installment_payload.get("paid_value")),
-                "created_at": datetime.now(timezone.utc).isoformat(),
-            }
-            await db.installments.insert_one(installment_record)
+            imported_installments.append(
+                build_installment_record(
+                    agreement_record["id"],
+                    agreement_record["case_id"],
+                    current_user["id"],
+                    parse_int_value(installment_payload.get("number")),
+                    parse_date_value(installment_payload.get("due_date")),
+                    is_entry=parse_bool_value(installment_payload.get("is_entry")) or False,
+                    paid_date=parse_date_value(installment_payload.get("paid_date")),
+                    paid_value=parse_float_value(installment_payload.get("paid_value")),
+                )
+            )
+            agreements_with_installments.add(agreement_record["id"])
             totals["installments"] += 1
 
         if agreement_record:
@@ -1500,7 +3127,8 @@ async def commit_import_file(
             if total_received_raw not in ("", None):
                 total_received_value = parse_float_value(total_received_raw)
                 if total_received_value is not None and total_received_value > 0:
-                    total_received_import_values.setdefault(agreement_record["id"], total_received_value)            
+                    total_received_import_values.setdefault(agreement_record["id"], total_received_value)
+                    imported_agreement_cases[agreement_record["id"]] = agreement_record["case_id"]            
 
         has_alvara_payload = any(value not in ("", None) for value in alvara_payload.values())
         if case_record and has_alvara_payload:
@@ -1508,7 +3136,7 @@ async def commit_import_file(
             alvara_record = {
                 "id": str(uuid.uuid4()),
                 "case_id": case_record["id"],
-                "data_alvara": parse_date_value(alvara_payload.get("data_alvara")) or "",
+                "data_alvara": to_db_date(parse_date_value(alvara_payload.get("data_alvara"))),
                 "valor_alvara": alvara_value,
                 "beneficiario_codigo": str(alvara_payload.get("beneficiario_codigo") or ""),
                 "observacoes": alvara_payload.get("observacoes"),
@@ -1535,35 +3163,33 @@ async def commit_import_file(
         for agreement_id, total_received_value in total_received_import_values.items():
 
             # Se já existem parcelas para o acordo, NÃO criar parcela automática
-            existing_installment = await db.installments.find_one(
-                {"agreement_id": agreement_id},
-                {"_id": 1}
-            )
-
-            if existing_installment:
+            # (os acordos são todos criados nesta importação, então basta o controle em memória)
+            if agreement_id in agreements_with_installments:
                 continue
 
-            today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-            
-            installment_record = {
-                "id": str(uuid.uuid4()),
-                "agreement_id": agreement_id,
-                "is_entry": False,
-                "number": 1,
-                "due_date": today,
-                "paid_date": today,
-                "paid_value": total_received_value,
-                "created_at": datetime.now(timezone.utc).isoformat(),
-            }
-            
-            await db.installments.insert_one(installment_record)
+            today = datetime.now(timezone.utc).date()
+            imported_installments.append(
+                build_installment_record(
+                    agreement_id,
+                    imported_agreement_cases[agreement_id],
+                    current_user["id"],
+                    1,
+                    today,
+                    paid_date=today,
+                    paid_value=total_received_value,
+                )
+            )
             totals["installments"] += 1
+
+    await insert_installments(imported_installments)
     
-    for case_id in updated_case_ids:
-        try:
-            await update_case_materialized_fields(case_id)
-        except Exception:
-            pass
+    try:
+        await recompute_cases_materialized_fields(list(updated_case_ids))
+    except Exception:
+        logger.exception("Falha ao recalcular casos importados")
+
+    await sync_receipts_ledger(list(updated_case_ids))
+    invalidate_case_counts(current_user["id"])
 
     history_entry = {
         "id": str(uuid.uuid4()),
@@ -1574,11 +3200,7 @@ async def commit_import_file(
     }
     await db.import_history.insert_one(history_entry)
 
-    try:
-        os.remove(session["path"])
-    except OSError:
-        pass
-    IMPORT_SESSIONS.pop(payload.session_id, None)
+    discard_import_session(payload.session_id)
 
     return {
         "message": "Importação concluída",
@@ -1587,6 +3209,213 @@ async def commit_import_file(
     }
 
 
+def parse_statement_date(value: Any) -> Optional[date]:
+    if isinstance(value, str):
+        for fmt in ("%d/%m/%Y", "%d/%m/%y", "%Y%m%d"):
+            try:
+                return datetime.strptime(value.strip()[:10], fmt).date()
+            except ValueError:
+                continue
+    return safe_parse_date(parse_date_value(value))
+
+
+def resolve_statement_columns(columns: list[str], mapping: Optional[dict]) -> dict[str, Optional[str]]:
+    resolved: dict[str, Optional[str]] = {}
+    folded = {fold_search_text(column): column for column in columns}
+    for field, aliases in STATEMENT_COLUMN_ALIASES.items():
+        column = (mapping or {}).get(field)
+        if not column:
+            column = next((folded[alias] for alias in aliases if alias in folded), None)
+        resolved[field] = column
+    if not resolved["date"] or not resolved["value"]:
+        raise HTTPException(status_code=400, detail="Colunas de data e valor do extrato não identificadas")
+    return resolved
+
+
+def parse_ofx_transactions(text: str) -> list[dict[str, Any]]:
+    transactions = []
+    for block in re.findall(r"<STMTTRN>(.*?)(?:</STMTTRN>|(?=<STMTTRN>)|(?=</BANKTRANLIST>))", text, re.S | re.I):
+        # OFX 1.x (SGML) não fecha as tags; lê o valor até o próximo "<" ou fim de linha.
+        fields = {tag.upper(): value.strip() for tag, value in re.findall(r"<(\w+)>([^<\r\n]*)", block)}
+        transactions.append(
+            {
+                "date": fields.get("DTPOSTED", "")[:8],
+                "value": fields.get("TRNAMT"),
+                "description": fields.get("MEMO") or fields.get("NAME") or "",
+                "reference": fields.get("FITID"),
+            }
+        )
+    return transactions
+
+
+def load_statement_lines(session: dict[str, Any], mapping: Optional[dict]) -> list[dict[str, Any]]:
+    if session["extension"] == ".ofx":
+        with open(session["path"], "rb") as statement_file:
+            raw_lines = parse_ofx_transactions(statement_file.read().decode("latin-1"))
+    else:
+        df = load_import_dataframe(session)
+        columns = df.columns.tolist()
+        resolved = resolve_statement_columns(columns, mapping)
+        raw_lines = []
+        for _, row in df.iterrows():
+            row_data = build_row_data(row, columns)
+            raw_lines.append(
+                {
+                    "date": row_data.get(resolved["date"]),
+                    "value": row_data.get(resolved["value"]),
+                    "description": str(row_data.get(resolved["description"]) or "") if resolved["description"] else "",
+                    "reference": None,
+                }
+            )
+
+    lines = []
+    for index, raw in enumerate(raw_lines, start=1):
+        line_date = parse_statement_date(raw["date"])
+        value = parse_float_value(raw["value"])
+        # Apenas créditos interessam para conciliação de recebimentos.
+        if line_date is None or value is None or value <= 0:
+            continue
+        lines.append(
+            {
+                "line": index,
+                "date": line_date,
+                "value": round(value, 2),
+                "cents": int(round(value * 100)),
+                "description": raw["description"],
+                "reference": raw["reference"],
+            }
+        )
+    return lines
+
+
+async def load_open_installment_index(user_id: str) -> dict[int, list[tuple[int, dict[str, Any]]]]:
+    installments = await db.installments.find(
+        {"user_id": user_id, "paid_date": None},
+        {"_id": 0, "id": 1, "agreement_id": 1, "case_id": 1, "number": 1, "is_entry": 1, "due_date": 1},
+    ).to_list(None)
+    agreement_ids = list({inst["agreement_id"] for inst in installments})
+    agreements = {
+        agreement["id"]: agreement
+        async for agreement in db.agreements.find(
+            {"id": {"$in": agreement_ids}},
+            {"_id": 0, "id": 1, "installment_value": 1, "entry_value": 1},
+        )
+    }
+    case_ids = list({inst["case_id"] for inst in installments if inst.get("case_id")})
+    debtor_names = {
+        case["id"]: case.get("debtor_name", "")
+        async for case in db.cases.find(
+            {"id": {"$in": case_ids}, "user_id": user_id}, {"_id": 0, "id": 1, "debtor_name": 1}
+        )
+    }
+
+    # valor em centavos -> lista ordenada por (vencimento ordinal) para busca por janela com bisect
+    index: dict[int, list[tuple[int, dict[str, Any]]]] = {}
+    for inst in installments:
+        agreement = agreements.get(inst["agreement_id"])
+        due_date = safe_parse_date(inst.get("due_date"))
+        if not agreement or due_date is None or inst.get("case_id") not in debtor_names:
+            continue
+        value = agreement.get("entry_value") if inst.get("is_entry") else agreement.get("installment_value")
+        if not value:
+            continue
+        candidate = {
+            "installment_id": inst["id"],
+            "case_id": inst["case_id"],
+            "debtor_name": debtor_names[inst["case_id"]],
+            "number": inst.get("number"),
+            "is_entry": bool(inst.get("is_entry")),
+            "due_date": due_date.isoformat(),
+            "value": round(value, 2),
+        }
+        index.setdefault(int(round(value * 100)), []).append((due_date.toordinal(), candidate))
+    for bucket in index.values():
+        bucket.sort(key=lambda item: item[0])
+    return index
+
+
+def match_statement_lines(
+    lines: list[dict[str, Any]],
+    index: dict[int, list[tuple[int, dict[str, Any]]]],
+    window_days: int,
+) -> list[dict[str, Any]]:
+    claimed: set[str] = set()
+    proposals = []
+    for line in sorted(lines, key=lambda item: item["date"]):
+        bucket = index.get(line["cents"], [])
+        ordinal = line["date"].toordinal()
+        start = bisect.bisect_left(bucket, ordinal - window_days, key=lambda item: item[0])
+        stop = bisect.bisect_right(bucket, ordinal + window_days, key=lambda item: item[0])
+        candidates = sorted(
+            (
+                {**candidate, "distance_days": due_ordinal - ordinal}
+                for due_ordinal, candidate in bucket[start:stop]
+                if candidate["installment_id"] not in claimed
+            ),
+            key=lambda candidate: abs(candidate["distance_days"]),
+        )[:STATEMENT_MAX_CANDIDATES]
+        if candidates:
+            claimed.add(candidates[0]["installment_id"])
+        proposals.append(
+            {
+                "line": line["line"],
+                "date": line["date"].isoformat(),
+                "value": line["value"],
+                "description": line["description"],
+                "reference": line["reference"],
+                "match": candidates[0] if candidates else None,
+                "alternatives": candidates[1:],
+            }
+        )
+    proposals.sort(key=lambda proposal: proposal["line"])
+    return proposals
+
+
+def get_statement_session(session_id: str, user_id: str) -> dict[str, Any]:
+    session = get_import_session(session_id, user_id)
+    if session.get("kind") != "statement":
+        raise HTTPException(status_code=404, detail="Sessão de importação não encontrada")
+    return session
+
+
+@import_router.post("/statement/upload")
+async def upload_bank_statement(
+    file: UploadFile = File(...),
+    current_user: dict = Depends(get_current_user)
+):
+    session_id = await store_import_upload(file, current_user["id"], STATEMENT_ALLOWED_EXTENSIONS, kind="statement")
+    return {"session_id": session_id}
+
+
+@import_router.post("/statement/match")
+async def match_bank_statement(
+    payload: StatementMatchRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    session = get_statement_session(payload.session_id, current_user["id"])
+    window_days = min(max(payload.window_days, 0), STATEMENT_MAX_WINDOW_DAYS)
+    lines = load_statement_lines(session, payload.mapping)
+    index = await load_open_installment_index(current_user["id"])
+    proposals = match_statement_lines(lines, index, window_days)
+    return {
+        "proposals": proposals,
+        "total_lines": len(lines),
+        "matched": sum(1 for proposal in proposals if proposal["match"]),
+    }
+
+
+@import_router.post("/statement/confirm")
+async def confirm_bank_statement(
+    payload: StatementConfirmRequest,
+    sync: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    get_statement_session(payload.session_id, current_user["id"])
+    result = await apply_installment_payments(payload.items, current_user["id"], sync)
+    discard_import_session(payload.session_id)
+    return result
+
+
 @import_router.get("/history")
 async def get_import_history(current_user: dict = Depends(get_current_user)):
     history = await db.import_history.find(
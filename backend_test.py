@@ -321,9 +321,9 @@ class JudicialAgreementTester:
                     200
                 )
                 
-                if success_alvara and len(alvaras_response) > 0:
+                if success_alvara and len(alvaras_response.get('alvaras', [])) > 0:
                     self.log_test("Automatic alvará creation", True)
-                    self.created_alvara_id = alvaras_response[0]['id']
+                    self.created_alvara_id = alvaras_response['alvaras'][0]['id']
                 else:
                     self.log_test("Automatic alvará creation", False, "No alvará found")
             
@@ -0,0 +1,105 @@
+from typing import Any
+
+import pytest
+
+from server import build_keyset_filter
+
+
+def sort_key(value: Any) -> tuple[int, Any]:
+    # MongoDB ordena null/ausente antes de qualquer valor.
+    return (0, 0) if value is None else (1, value)
+
+
+def matches(document: dict[str, Any], condition: dict[str, Any]) -> bool:
+    for key, expected in condition.items():
+        if key == "$or":
+            if not any(matches(document, branch) for branch in expected):
+                return False
+            continue
+        value = document.get(key)
+        if not isinstance(expected, dict):
+            if value != expected:
+                return False
+            continue
+        for operator, operand in expected.items():
+            if operator == "$ne":
+                ok = value != operand
+            elif value is None or operand is None:
+                # $gt/$lt não comparam null com valores.
+                ok = False
+            elif operator == "$gt":
+                ok = value > operand
+            elif operator == "$lt":
+                ok = value < operand
+            else:
+                raise AssertionError(f"operador inesperado: {operator}")
+            if not ok:
+                return False
+    return True
+
+
+def paginate(documents: list[dict[str, Any]], direction: int, page_size: int) -> list[str]:
+    ordered = sorted(
+        documents,
+        key=lambda doc: (sort_key(doc["value"]), doc["id"]),
+        reverse=direction == -1,
+    )
+    seen: list[str] = []
+    remaining = ordered
+    page = remaining[:page_size]
+    while page:
+        seen.extend(doc["id"] for doc in page)
+        last = page[-1]
+        condition = build_keyset_filter("value", direction, last["value"], last["id"])
+        remaining = [doc for doc in ordered if matches(doc, condition)]
+        page = remaining[:page_size]
+    return seen
+
+
+DOCUMENTS = [
+    {"id": "a", "value": None},
+    {"id": "b", "value": 10},
+    {"id": "c", "value": None},
+    {"id": "d", "value": 5},
+    {"id": "e", "value": 10},
+    {"id": "f", "value": 7},
+    {"id": "g", "value": None},
+]
+
+
+@pytest.mark.parametrize("direction", [1, -1])
+@pytest.mark.parametrize("page_size", [1, 2, 3, 10])
+def test_keyset_pages_cover_every_document_once(direction, page_size):
+    expected = [
+        doc["id"]
+        for doc in sorted(
+            DOCUMENTS,
+            key=lambda doc: (sort_key(doc["value"]), doc["id"]),
+            reverse=direction == -1,
+        )
+    ]
+    assert paginate(DOCUMENTS, direction, page_size) == expected
+
+
+def test_null_value_ascending_continues_into_non_null_values():
+    condition = build_keyset_filter("value", 1, None, "c")
+    assert condition == {"$or": [{"value": None, "id": {"$gt": "c"}}, {"value": {"$ne": None}}]}
+
+
+def test_null_value_descending_stays_within_nulls():
+    condition = build_keyset_filter("value", -1, None, "c")
+    assert condition == {"value": None, "id": {"$lt": "c"}}
+
+
+def test_descending_value_includes_trailing_nulls():
+    condition = build_keyset_filter("value", -1, 5, "d")
+    assert {"value": None} in condition["$or"]
+    assert matches({"id": "z", "value": None}, condition)
+    assert not matches({"id": "z", "value": 7}, condition)
+
+
+def test_ascending_value_excludes_nulls():
+    condition = build_keyset_filter("value", 1, 5, "d")
+    assert not matches({"id": "z", "value": None}, condition)
+    assert matches({"id": "e", "value": 5}, condition)
+    assert not matches({"id": "a", "value": 5}, condition)
@@ -0,0 +1,101 @@
+from datetime import datetime
+
+from pymongo import DeleteMany, InsertOne, UpdateOne
+
+from server import build_installment_record, build_installment_schedule, diff_installment_schedule
+
+
+def existing_schedule(first_due: str, count: int, has_entry: bool = False) -> list[dict]:
+    return build_installment_schedule(
+        "agreement", "case", "user", first_due, count, has_entry=has_entry, entry_date="2024-01-05"
+    )
+
+
+def split(operations: list) -> tuple[list, list, list]:
+    updates = [op for op in operations if isinstance(op, UpdateOne)]
+    inserts = [op for op in operations if isinstance(op, InsertOne)]
+    deletes = [op for op in operations if isinstance(op, DeleteMany)]
+    return updates, inserts, deletes
+
+
+def deleted_ids(deletes: list) -> set[str]:
+    return {installment_id for op in deletes for installment_id in op._filter["id"]["$in"]}
+
+
+def test_unchanged_schedule_produces_no_operations():
+    existing = existing_schedule("2024-01-31", 6)
+    desired = existing_schedule("2024-01-31", 6)
+    assert diff_installment_schedule(existing, desired) == []
+
+
+def test_longer_schedule_inserts_only_the_tail():
+    existing = existing_schedule("2024-01-31", 3)
+    desired = existing_schedule("2024-01-31", 5)
+    updates, inserts, deletes = split(diff_installment_schedule(existing, desired))
+    assert updates == [] and deletes == []
+    assert [op._doc["number"] for op in inserts] == [4, 5]
+    assert [op._doc["due_date"] for op in inserts] == [datetime(2024, 4, 30), datetime(2024, 5, 31)]
+
+
+def test_shorter_schedule_deletes_only_the_surplus():
+    existing = existing_schedule("2024-01-31", 5)
+    desired = existing_schedule("2024-01-31", 2)
+    updates, inserts, deletes = split(diff_installment_schedule(existing, desired))
+    assert updates == [] and inserts == []
+    assert deleted_ids(deletes) == {inst["id"] for inst in existing if inst["number"] > 2}
+
+
+def test_moved_first_due_updates_dates_and_keeps_ids():
+    existing = existing_schedule("2024-01-31", 3)
+    desired = existing_schedule("2024-02-10", 3)
+    updates, inserts, deletes = split(diff_installment_schedule(existing, desired))
+    assert inserts == [] and deletes == []
+    assert [op._filter["id"] for op in updates] == [inst["id"] for inst in existing]
+    assert [op._doc["$set"]["due_date"] for op in updates] == [
+        datetime(2024, 2, 10),
+        datetime(2024, 3, 10),
+        datetime(2024, 4, 10),
+    ]
+
+
+def test_only_changed_due_dates_are_updated():
+    existing = existing_schedule("2024-01-15", 3)
+    existing[1]["due_date"] = datetime(2024, 2, 20)
+    desired = existing_schedule("2024-01-15", 3)
+    updates, _, _ = split(diff_installment_schedule(existing, desired))
+    assert [op._filter["id"] for op in updates] == [existing[1]["id"]]
+
+
+def test_legacy_string_due_dates_compare_as_dates():
+    existing = existing_schedule("2024-01-15", 2)
+    for inst in existing:
+        inst["due_date"] = inst["due_date"].strftime("%Y-%m-%d")
+    assert diff_installment_schedule(existing, existing_schedule("2024-01-15", 2)) == []
+
+
+def test_paid_installments_are_left_untouched():
+    existing = existing_schedule("2024-01-31", 3)
+    existing[2]["paid_date"] = datetime(2024, 3, 31)
+    desired = existing_schedule("2024-01-31", 2)
+    updates, inserts, deletes = split(diff_installment_schedule(existing, desired))
+    assert updates == [] and inserts == [] and deletes == []
+
+
+def test_duplicate_numbers_keep_the_first_and_delete_the_rest():
+    existing = existing_schedule("2024-01-31", 2)
+    duplicate = build_installment_record("agreement", "case", "user", 2, "2024-02-29")
+    existing.append(duplicate)
+    updates, inserts, deletes = split(diff_installment_schedule(existing, existing_schedule("2024-01-31", 2)))
+    assert updates == [] and inserts == []
+    assert deleted_ids(deletes) == {duplicate["id"]}
+
+
+def test_unpaid_entries_are_kept_unless_dropped():
+    existing = existing_schedule("2024-01-31", 2, has_entry=True)
+    entry_id = existing[0]["id"]
+    desired = existing_schedule("2024-01-31", 2)
+
+    assert diff_installment_schedule(existing, desired) == []
+
+    _, _, deletes = split(diff_installment_schedule(existing, desired, drop_unpaid_entries=True))
+    assert deleted_ids(deletes) == {entry_id}
@@ -0,0 +1,55 @@
+from datetime import date, datetime
+
+import pytest
+from dateutil.relativedelta import relativedelta
+
+from server import build_installment_schedule, compute_monthly_due_dates
+
+
+def due_dates(first_due: date, count: int) -> list[date]:
+    return compute_monthly_due_dates(first_due, count).astype(object).tolist()
+
+
+def test_end_of_month_clamps_without_drifting():
+    assert due_dates(date(2024, 1, 31), 4) == [
+        date(2024, 1, 31),
+        date(2024, 2, 29),
+        date(2024, 3, 31),
+        date(2024, 4, 30),
+    ]
+
+
+def test_february_in_non_leap_year():
+    assert due_dates(date(2023, 1, 30), 3) == [date(2023, 1, 30), date(2023, 2, 28), date(2023, 3, 30)]
+
+
+def test_crosses_year_boundary():
+    assert due_dates(date(2024, 11, 15), 3) == [date(2024, 11, 15), date(2024, 12, 15), date(2025, 1, 15)]
+
+
+@pytest.mark.parametrize("first_due", [date(2024, 1, 31), date(2023, 8, 29), date(2020, 2, 29), date(2021, 5, 1)])
+def test_matches_relativedelta(first_due):
+    assert due_dates(first_due, 36) == [first_due + relativedelta(months=i) for i in range(36)]
+
+
+def test_zero_installments():
+    assert due_dates(date(2024, 1, 1), 0) == []
+
+
+def test_schedule_with_entry():
+    schedule = build_installment_schedule(
+        "agreement", "case", "user", "2024-01-31", 2, has_entry=True, entry_date="2024-01-10"
+    )
+    assert [(inst["is_entry"], inst["number"], inst["due_date"]) for inst in schedule] == [
+        (True, None, datetime(2024, 1, 10)),
+        (False, 1, datetime(2024, 1, 31)),
+        (False, 2, datetime(2024, 2, 29)),
+    ]
+    assert all(inst["paid_date"] is None and inst["agreement_id"] == "agreement" for inst in schedule)
+    assert len({inst["id"] for inst in schedule}) == 3
+
+
+def test_schedule_without_entry():
+    schedule = build_installment_schedule("agreement", "case", "user", "2024-03-15", 3)
+    assert [inst["number"] for inst in schedule] == [1, 2, 3]
+    assert not any(inst["is_entry"] for inst in schedule)
@@ -0,0 +1,139 @@
+from datetime import date
+
+from server import (
+    load_statement_lines,
+    match_statement_lines,
+    parse_ofx_transactions,
+    parse_statement_date,
+)
+
+SGML_OFX = """OFXHEADER:100
+DATA:OFXSGML
+VERSION:102
+
+<OFX>
+<BANKMSGSRSV1><STMTTRNRS><STMTRS>
+<BANKTRANLIST>
+<STMTTRN>
+<TRNTYPE>CREDIT
+<DTPOSTED>20240131120000[-3:BRT]
+<TRNAMT>150.00
+<FITID>sgml-1
+<MEMO>PIX JOAO
+<STMTTRN>
+<TRNTYPE>DEBIT
+<DTPOSTED>20240201
+<TRNAMT>-20.00
+<FITID>sgml-2
+<NAME>TARIFA
+</BANKTRANLIST>
+</STMTRS></STMTTRNRS></BANKMSGSRSV1>
+</OFX>
+"""
+
+XML_OFX = """<?xml version="1.0" encoding="UTF-8"?>
+<?OFX OFXHEADER="200" VERSION="220"?>
+<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>
+<STMTTRN><TRNTYPE>CREDIT</TRNTYPE><DTPOSTED>20240305</DTPOSTED><TRNAMT>99.90</TRNAMT><FITID>xml-1</FITID><MEMO>TED MARIA</MEMO></STMTTRN>
+<STMTTRN><TRNTYPE>CREDIT</TRNTYPE><DTPOSTED>20240306</DTPOSTED><TRNAMT>10.00</TRNAMT><FITID>xml-2</FITID><NAME>DEPOSITO</NAME></STMTTRN>
+</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>
+"""
+
+
+def test_parse_sgml_ofx_without_closing_tags():
+    transactions = parse_ofx_transactions(SGML_OFX)
+    assert transactions == [
+        {"date": "20240131", "value": "150.00", "description": "PIX JOAO", "reference": "sgml-1"},
+        {"date": "20240201", "value": "-20.00", "description": "TARIFA", "reference": "sgml-2"},
+    ]
+
+
+def test_parse_xml_ofx_with_closing_tags():
+    transactions = parse_ofx_transactions(XML_OFX)
+    assert transactions == [
+        {"date": "20240305", "value": "99.90", "description": "TED MARIA", "reference": "xml-1"},
+        {"date": "20240306", "value": "10.00", "description": "DEPOSITO", "reference": "xml-2"},
+    ]
+
+
+def test_statement_lines_keep_only_credits(tmp_path):
+    path = tmp_path / "extrato.ofx"
+    path.write_text(SGML_OFX, encoding="latin-1")
+    lines = load_statement_lines({"extension": ".ofx", "path": str(path)}, None)
+    assert [(line["date"], line["cents"], line["reference"]) for line in lines] == [
+        (date(2024, 1, 31), 15000, "sgml-1"),
+    ]
+
+
+def test_csv_statement_with_brazilian_formats(tmp_path):
+    path = tmp_path / "extrato.csv"
+    path.write_text('Data,Descrição,Valor\n30/01/2024,PIX MARIA,"1.234,56"\n02/02/2024,TARIFA,-5\n', encoding="utf-8")
+    lines = load_statement_lines({"extension": ".csv", "path": str(path)}, None)
+    assert [(line["date"], line["cents"], line["description"]) for line in lines] == [
+        (date(2024, 1, 30), 123456, "PIX MARIA"),
+    ]
+
+
+def test_parse_statement_date_formats():
+    assert parse_statement_date("05/02/2024") == date(2024, 2, 5)
+    assert parse_statement_date("05/02/24") == date(2024, 2, 5)
+    assert parse_statement_date("20240205") == date(2024, 2, 5)
+    assert parse_statement_date("2024-02-05") == date(2024, 2, 5)
+
+
+def build_index(*candidates: tuple[str, int, str]) -> dict:
+    index: dict = {}
+    for installment_id, cents, due in candidates:
+        due_date = date.fromisoformat(due)
+        index.setdefault(cents, []).append(
+            (due_date.toordinal(), {"installment_id": installment_id, "due_date": due})
+        )
+    for bucket in index.values():
+        bucket.sort(key=lambda item: item[0])
+    return index
+
+
+def line(number: int, day: str, cents: int) -> dict:
+    return {
+        "line": number,
+        "date": date.fromisoformat(day),
+        "value": cents / 100,
+        "cents": cents,
+        "description": "",
+        "reference": None,
+    }
+
+
+def test_match_picks_nearest_due_date_within_window():
+    index = build_index(("far", 15000, "2024-01-24"), ("near", 15000, "2024-01-30"), ("late", 15000, "2024-02-03"))
+    [proposal] = match_statement_lines([line(1, "2024-01-31", 15000)], index, 5)
+    assert proposal["match"]["installment_id"] == "near"
+    assert proposal["match"]["distance_days"] == -1
+    assert [candidate["installment_id"] for candidate in proposal["alternatives"]] == ["late"]
+
+
+def test_window_bounds_are_inclusive():
+    index = build_index(("edge", 15000, "2024-01-26"))
+    [inside] = match_statement_lines([line(1, "2024-01-31", 15000)], index, 5)
+    [outside] = match_statement_lines([line(1, "2024-01-31", 15000)], index, 4)
+    assert inside["match"]["installment_id"] == "edge"
+    assert outside["match"] is None
+
+
+def test_value_must_match_to_the_cent():
+    index = build_index(("a", 15000, "2024-01-31"))
+    [proposal] = match_statement_lines([line(1, "2024-01-31", 15001)], index, 5)
+    assert proposal["match"] is None and proposal["alternatives"] == []
+
+
+def test_claimed_candidate_is_not_proposed_twice():
+    index = build_index(("first", 15000, "2024-01-31"), ("second", 15000, "2024-02-29"))
+    proposals = match_statement_lines(
+        [line(2, "2024-02-01", 15000), line(1, "2024-01-31", 15000), line(3, "2024-02-02", 15000)],
+        index,
+        30,
+    )
+    assert [proposal["line"] for proposal in proposals] == [1, 2, 3]
+    assert proposals[0]["match"]["installment_id"] == "first"
+    assert proposals[1]["match"]["installment_id"] == "second"
+    assert proposals[2]["match"] is None